@@ -27,10 +27,9 @@ except Exception:
     def tqdm(x, **_kw):
         return x
 
-import numpy as np
-
 # import local helpers
 from src.get_city_messages import get_city_messages
+from src import metrics
 
 ROOT = Path('.')
 DATA_PATH = ROOT / 'api_1.json'
@@ -38,6 +37,7 @@ OUT_DIR = ROOT / 'results'
 OUT_DIR.mkdir(exist_ok=True)
 OUT_FILE = OUT_DIR / 'api_1_analysis_2mn.json'
 OUT_FILE_PARTIAL = OUT_DIR / (OUT_FILE.stem + '.partial.json')
+PROFILE_FILE = OUT_DIR / (OUT_FILE.stem + '.profile.json')
 
 
 def ts_to_iso(ts):
@@ -48,54 +48,6 @@ def ts_to_iso(ts):
 
 
 # Copied/adapted helpers from run_batch_analysis.py
-def batch_classify_texts(texts, zshot, sentiment_clf, OECD_CATEGORIES, topk_mean=None, threshold=0.25, batch_size=32):
-    T = len(texts)
-    cat_scores = {cat: [0.0] * T for cat in OECD_CATEGORIES.keys()}
-    cat_best_label = {cat: [None] * T for cat in OECD_CATEGORIES.keys()}
-    cat_label_scores = {cat: [None] * T for cat in OECD_CATEGORIES.keys()}
-
-    # 1) For each category, run zshot on texts in chunks
-    for cat, labels in OECD_CATEGORIES.items():
-        for start in range(0, T, batch_size):
-            batch_texts = texts[start:start+batch_size]
-            results = zshot(batch_texts, candidate_labels=labels, multi_label=True, batch_size=batch_size)
-            for idx, out in enumerate(results, start=start):
-                label_scores = list(zip(out["labels"], out["scores"]))
-                label_scores.sort(key=lambda x: x[1], reverse=True)
-                if topk_mean and topk_mean > 1:
-                    k = min(topk_mean, len(label_scores))
-                    agg = float(np.mean([s for _, s in label_scores[:k]]))
-                else:
-                    agg = float(label_scores[0][1])
-                cat_scores[cat][idx] = agg
-                cat_best_label[cat][idx] = label_scores[0][0]
-                cat_label_scores[cat][idx] = label_scores
-
-    # 2) Sentiment for all texts in batches
-    sent_results = []
-    for start in range(0, T, batch_size):
-        batch_texts = texts[start:start+batch_size]
-        sent_batch = sentiment_clf(batch_texts, batch_size=batch_size)
-        sent_results.extend(sent_batch)
-
-    # 3) Build per-text outputs
-    outputs = []
-    for i in range(T):
-        per_cat = {cat: cat_scores[cat][i] for cat in OECD_CATEGORIES.keys()}
-        best_cat, best_score = max(per_cat.items(), key=lambda kv: kv[1])
-        is_confident = best_score >= threshold
-        out = {
-            "predicted_category": best_cat if is_confident else "none",
-            "category_score": best_score,
-            "top_keyword": cat_best_label[best_cat][i],
-            "all_category_scores": per_cat,
-            "explanation_top3_keywords": cat_label_scores[best_cat][i][:3] if cat_label_scores[best_cat][i] is not None else [],
-            "sentiment": sent_results[i],
-        }
-        outputs.append(out)
-    return outputs
-
-
 def batch_compute_topic_signed_scores(texts, OECD_TOPICS, batch_classify_fn, topk_mean=3, threshold=0.25, batch_size=32):
     outs = batch_classify_fn(texts, topk_mean=topk_mean, threshold=threshold, batch_size=batch_size)
     per_topic_values = defaultdict(list)
@@ -137,7 +89,7 @@ def main(args):
         raise RuntimeError('Could not import pipeline modules. Ensure your PYTHONPATH and dependencies are installed.') from e
 
     # load api_1.json and extract city names
-    with open(DATA_PATH, 'r', encoding='utf-8') as f:
+    with open(DATA_PATH, 'r', encoding='utf-8') as f, metrics.timer('json_parse'):
         data = json.load(f)
 
     city_names = [entry.get('city', '') for entry in data if 'city' in entry]
@@ -148,7 +100,9 @@ def main(args):
 
     # sample posts that mention any of the cities
     print('Sampling posts from the two-million bluesky dataset (this may take some time)')
-    sampled_posts = get_city_messages(args.n_samples, cities=city_names)
+    with metrics.timer('get_city_messages'):
+        sampled_posts = get_city_messages(args.n_samples, cities=city_names)
+    metrics.inc('posts_ingested', len(sampled_posts))
     print(f"Retrieved {len(sampled_posts)} sampled posts")
     # stream results into a partial file so we persist progress as we go
     first = True
@@ -158,46 +112,49 @@ def main(args):
 
     # For each city, filter sampled posts that mention that city and run analysis
     for city in tqdm(city_names, desc='Cities (sampled)'):
-        pat = re.compile(r"\b" + re.escape(city) + r"\b", flags=re.IGNORECASE)
-        texts_all = [p.get('text', '') for p in sampled_posts if pat.search(p.get('text', ''))]
-
-        if texts_all:
-            raw_overall, details_overall = batch_compute_topic_signed_scores(
-                texts_all,
-                OECD_TOPICS,
-                lambda texts, topk_mean=args.topk_mean, threshold=args.threshold, batch_size=args.batch_size: batch_classify_texts(
-                    texts, cs.zshot, cs.sentiment_clf, cs.OECD_CATEGORIES, topk_mean=topk_mean, threshold=threshold, batch_size=batch_size
-                ),
-                topk_mean=args.topk_mean,
-                threshold=args.threshold,
-                batch_size=args.batch_size,
-            )
-            topic_0_10 = normalize_topic_scores_0_10(raw_overall)
-            chs = compute_CHS(topic_0_10)
-        else:
-            topic_0_10 = {t: 0.0 for t in OECD_TOPICS}
-            chs = 0.0
-
-        out_obj = {
-            'city': city,
-            'n_sampled_posts': len(texts_all),
-            'overall_topic_scores_0_10': topic_0_10,
-            'overall_chs': chs,
-        }
-
-        # write comma-separated JSON objects into the array
-        if not first:
-            fout.write(',\n')
-        json.dump(out_obj, fout, ensure_ascii=False)
-        fout.flush()
-        try:
-            os.fsync(fout.fileno())
-        except Exception:
-            pass
-        first = False
-
-        if len(preview) < 20:
-            preview.append(out_obj)
+        with metrics.profiled('city'):
+            pat = re.compile(r"\b" + re.escape(city) + r"\b", flags=re.IGNORECASE)
+            with metrics.timer('city_match'):
+                texts_all = [p.get('text', '') for p in sampled_posts if pat.search(p.get('text', ''))]
+            metrics.inc('posts_matched', len(texts_all))
+
+            if texts_all:
+                raw_overall, details_overall = batch_compute_topic_signed_scores(
+                    texts_all,
+                    OECD_TOPICS,
+                    cs.classify_batch_with_sentiment,
+                    topk_mean=args.topk_mean,
+                    threshold=args.threshold,
+                    batch_size=args.batch_size,
+                )
+                with metrics.timer('aggregation'):
+                    topic_0_10 = normalize_topic_scores_0_10(raw_overall)
+                    chs = compute_CHS(topic_0_10)
+            else:
+                topic_0_10 = {t: 0.0 for t in OECD_TOPICS}
+                chs = 0.0
+
+            out_obj = {
+                'city': city,
+                'n_sampled_posts': len(texts_all),
+                'overall_topic_scores_0_10': topic_0_10,
+                'overall_chs': chs,
+            }
+
+            # write comma-separated JSON objects into the array
+            with metrics.timer('output_write'):
+                if not first:
+                    fout.write(',\n')
+                json.dump(out_obj, fout, ensure_ascii=False)
+                fout.flush()
+                try:
+                    os.fsync(fout.fileno())
+                except Exception:
+                    pass
+            first = False
+
+            if len(preview) < 20:
+                preview.append(out_obj)
     # close JSON array and atomically move into final file
     fout.write('\n]\n')
     fout.close()
@@ -205,6 +162,7 @@ def main(args):
         os.replace(OUT_FILE_PARTIAL, OUT_FILE)
     except Exception:
         os.rename(OUT_FILE_PARTIAL, OUT_FILE)
+    metrics.write_profile_summary(PROFILE_FILE)
 
     # brief summary (first few cities processed)
     for r in preview:
@@ -1,29 +1,115 @@
 import asyncio
+import atexit
 import json
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 import websockets
 import pandas as pd
 import nltk
 import datetime
 import math
+import os
 import re
+import threading
+import time
+from collections import namedtuple
+from src import metrics
+from src.live_stream import DeltaBroadcaster
+from src.state_store import StateStore, file_fingerprint
+from src.timeseries_store import RESOLUTIONS, TimeSeriesStore, add_batch_results
 # from src.classify_sentiment import classify_with_sentiment
 # from src.CHS_computation import compute_topic_signed_scores, normalize_topic_scores_0_10, compute_CHS
 
 app = Flask(__name__)
 
+# input locations (overridable, e.g. to point the benchmarks at synthetic fixtures)
+CITIES_CSV = os.environ.get('CITYPULSE_CITIES_CSV', 'simplemaps_worldcities_basicv1.901/worldcities.csv')
+MENTIONS_FILE = os.environ.get('CITYPULSE_MENTIONS_FILE', 'city_mentions.jsonl')
+
+# how often the ingestion worker tails MENTIONS_FILE and republishes the snapshot, seconds
+INGEST_INTERVAL = float(os.environ.get('CITYPULSE_INGEST_INTERVAL', '1.0'))
+# set to 0 to disable the background worker (benchmarks / tests drive ingestion themselves)
+INGEST_WORKER = os.environ.get('CITYPULSE_INGEST_WORKER', '1') != '0'
+
+# city state, only touched by the ingestion worker (under ingest_lock)
 counts = {}
 n_lines_read = 0
-lock = False
+ingest_offset = 0  # byte offset of the first unread line in MENTIONS_FILE
+ingest_lock = threading.Lock()
+
+# what request handlers serve: replaced wholesale, never mutated after publishing
+Snapshot = namedtuple('Snapshot', ['version', 'generated_at', 'n_lines_read', 'cities', 'body'])
+snapshot = None
+# per-city score deltas for /stream clients, fed from publish_snapshot
+broadcaster = DeltaBroadcaster(score_epsilon=float(os.environ.get('CITYPULSE_STREAM_EPSILON', '0.05')))
+STREAM_MIN_INTERVAL = float(os.environ.get('CITYPULSE_STREAM_INTERVAL', '1.0'))
+_worker = None
+_worker_stop = threading.Event()
+
+# per-city rolling history (minute / hour / day bins), kept beyond the 1 hour live window
+history = TimeSeriesStore()
+
+# durable checkpoint of the state above for warm restarts ('' disables it)
+STATE_DB = os.environ.get('CITYPULSE_STATE_DB', 'results/live_state.db')
+CHECKPOINT_INTERVAL = float(os.environ.get('CITYPULSE_CHECKPOINT_INTERVAL', '30'))
+state_store = StateStore(STATE_DB) if STATE_DB else None
+_last_checkpoint = 0.0
+
+@app.before_request
+def _ensure_worker():
+  # fallback for WSGI servers that import `app` without running __main__
+  if INGEST_WORKER:
+    start_ingest_worker()
 
 @app.route("/")
 def hello_world():
-  read_from_file()
-  counts = calculate_city_scores()
-  counts_ = [{'city': city, 'score': city_stuff['score'], 'posts': city_stuff['posts'], 'lat': cities_df[(cities_df['city'] == city) & (cities_df['iso2'] == 'GB')]['lat'].values[0], 'lng': cities_df[(cities_df['city'] == city) & (cities_df['iso2'] == 'GB')]['lng'].values[0]} for city, city_stuff in counts.items()]
-  counts_.sort(key=lambda x: x['score'], reverse=True)
-  return jsonify(counts_)
+  with metrics.timer('request', endpoint='/'), metrics.profiled('index'):
+    snap = snapshot
+    if snap is None:
+      # nothing published yet (worker disabled or still on its first pass)
+      snap = refresh()
+    return Response(snap.body, mimetype='application/json', headers={'X-Snapshot-Version': str(snap.version)})
 
+@app.route("/stream")
+def stream():
+  """
+  Server-sent events: a compact snapshot ({city: score, posts, lat, lng}),
+  then coalesced per-city deltas at most every STREAM_MIN_INTERVAL seconds.
+  """
+  if snapshot is None:
+    refresh()
+  last_seq = request.headers.get('Last-Event-ID', type=int)
+  return Response(broadcaster.stream(last_seq, min_interval=STREAM_MIN_INTERVAL), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route("/history/<city>")
+def city_history(city):
+  """
+  Downsampled history for one city.
+  Query args: start, end (unix seconds; default the last 7 days),
+  resolution ('minute' | 'hour' | 'day' or a step in seconds).
+  """
+  end = request.args.get('end', int(time.time()), type=int)
+  start = request.args.get('start', end - 7 * 86400, type=int)
+  resolution = request.args.get('resolution')
+  if resolution in RESOLUTIONS:
+    step = RESOLUTIONS[resolution][0]
+  elif resolution:
+    if not resolution.isdigit() or int(resolution) <= 0:
+      return jsonify({'error': f'invalid resolution: {resolution}'}), 400
+    step = int(resolution)
+  else:
+    step = None
+  if end < start:
+    return jsonify({'error': 'end must be >= start'}), 400
+  series = history.series(city, start, end, step)
+  if series is None:
+    return jsonify({'error': f'no history for {city}'}), 404
+  return jsonify(series)
+
+@app.route("/metrics")
+def prometheus_metrics():
+  return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@metrics.timed_fn('aggregation')
 def calculate_city_scores():
   current_time = int(datetime.datetime.now().timestamp())
   for city, city_stuff in counts.items():
@@ -39,33 +125,142 @@ def calculate_city_scores():
 
   return counts
 
+def publish_snapshot():
+  """Score the current city state and swap in a new immutable snapshot."""
+  global snapshot
+  with metrics.timer('snapshot_build'):
+    scored = calculate_city_scores()
+    cities = [{'city': city, 'score': city_stuff['score'], 'posts': list(city_stuff['posts']), 'lat': gb_coords[city][0], 'lng': gb_coords[city][1]} for city, city_stuff in scored.items()]
+    cities.sort(key=lambda x: x['score'], reverse=True)
+    version = snapshot.version + 1 if snapshot is not None else 1
+    snap = Snapshot(version, time.time(), n_lines_read, tuple(cities), app.json.dumps(cities).encode('utf-8'))
+  snapshot = snap
+  broadcaster.publish(cities)
+  return snap
+
+def refresh():
+  """One ingestion pass: read new lines, rescore, publish."""
+  with ingest_lock:
+    read_from_file()
+    return publish_snapshot()
+
+def checkpoint():
+  """Persist city state, changed history and the ingest position."""
+  global _last_checkpoint
+  if state_store is None:
+    return
+  with ingest_lock, metrics.timer('checkpoint'):
+    meta = {
+      'mentions_file': os.path.abspath(MENTIONS_FILE),
+      'ingest_offset': ingest_offset,
+      'n_lines_read': n_lines_read,
+      'fingerprint': file_fingerprint(MENTIONS_FILE, ingest_offset) if os.path.exists(MENTIONS_FILE) else None,
+      'checkpointed_at': time.time(),
+    }
+    dirty = history.dirty_cities()
+    state_store.checkpoint(meta, counts, {city: history.export_city(city) for city in dirty})
+    # only after the commit, so a failed write is retried with the same cities next time
+    history.mark_clean(dirty)
+  _last_checkpoint = time.time()
+
+def restore_state():
+  """Load the latest checkpoint if it still matches MENTIONS_FILE; returns True on success."""
+  global counts, n_lines_read, ingest_offset, _last_checkpoint
+  if state_store is None:
+    return False
+  with metrics.timer('restore'):
+    state = state_store.load()
+    if state is None:
+      return False
+    if not state_store.matches_input(state['meta'], MENTIONS_FILE):
+      app.logger.warning('state in %s does not match %s, re-ingesting from the start', STATE_DB, MENTIONS_FILE)
+      # stale history rows would otherwise be mixed into the next restore
+      state_store.clear()
+      return False
+    counts = state['counts']
+    ingest_offset = state['meta']['ingest_offset']
+    n_lines_read = state['meta']['n_lines_read']
+    for city, data in state['history'].items():
+      history.import_city(city, data)
+  _last_checkpoint = time.time()
+  return True
+
+def _ingest_loop(interval):
+  while not _worker_stop.is_set():
+    try:
+      refresh()
+      if state_store is not None and time.time() - _last_checkpoint >= CHECKPOINT_INTERVAL:
+        checkpoint()
+    except Exception as e:
+      metrics.inc('ingest_errors')
+      app.logger.exception('ingestion pass failed: %s', e)
+    _worker_stop.wait(interval)
+
+def start_ingest_worker(interval=None):
+  """Start the background ingestion thread (idempotent)."""
+  global _worker
+  if _worker is not None and _worker.is_alive():
+    return _worker
+  with ingest_lock:
+    if _worker is None or not _worker.is_alive():
+      _worker_stop.clear()
+      _worker = threading.Thread(target=_ingest_loop, args=(interval or INGEST_INTERVAL,), name='citypulse-ingest', daemon=True)
+      _worker.start()
+  return _worker
+
+def stop_ingest_worker(timeout=5.0):
+  _worker_stop.set()
+  if _worker is not None:
+    _worker.join(timeout)
+
+@atexit.register
+def _shutdown():
+  # only the process that ran the worker has state worth saving (not e.g. the reloader parent)
+  if _worker is None:
+    return
+  stop_ingest_worker()
+  checkpoint()
+
 nltk.download('stopwords')
 stopwords = nltk.corpus.stopwords.words('english')
 nltk.download('punkt_tab')
 nltk.download('averaged_perceptron_tagger_eng')
 
-cities_df = pd.read_csv('simplemaps_worldcities_basicv1.901/worldcities.csv')
+cities_df = pd.read_csv(CITIES_CSV)
 # remove stopwords cities from dataframe
 cities_df = cities_df[~cities_df['city'].str.lower().isin(stopwords)]
 # remove cities name less than 4 characters
 cities_df = cities_df[cities_df['city'].str.len() >= 4]
 # sort by length descending
 cities_df = cities_df.sort_values(by='city', key=lambda x: x.str.len(), ascending=False)
+# GB lookups for the hot paths (first GB row per city, as the per-request dataframe filter used to pick)
+gb_rows = cities_df[cities_df['iso2'] == 'GB'].drop_duplicates('city')
+gb_cities = set(gb_rows['city'])
+gb_coords = {city: (lat, lng) for city, lat, lng in zip(gb_rows['city'], gb_rows['lat'], gb_rows['lng'])}
 
 uri = "wss://jetstream2.us-east.bsky.network/subscribe?wantedCollections=app.bsky.feed.post"
 
 def read_from_file():
-  global lock
-  if lock:
-    return
-  lock = True
-  with open('city_mentions.jsonl', 'r', encoding='utf-8') as infile:
-    global n_lines_read
-    for _ in range(n_lines_read):
-      next(infile)
+  """
+  Ingest lines appended to MENTIONS_FILE since the last call. Resumes from a
+  byte offset, and leaves a trailing partial line for the next call.
+  """
+  global n_lines_read, ingest_offset
+  with open(MENTIONS_FILE, 'rb') as infile:
+    infile.seek(ingest_offset)
+    # per-line times are summed and recorded once per call to keep the overhead flat
+    parse_seconds = match_seconds = 0.0
+    n_ingested = n_matched = 0
     for message in infile:
+      if not message.endswith(b'\n'):
+        break
+      ingest_offset += len(message)
       n_lines_read += 1
+      n_ingested += 1
+      t0 = time.perf_counter()
       data = json.loads(message)
+      t1 = time.perf_counter()
+      parse_seconds += t1 - t0
       if 'commit' in data and 'record' in data['commit'] and 'text' in data['commit']['record']:
         text = data['commit']['record']['text'].lower()
         for city in cities_df['city']:
@@ -73,9 +268,7 @@ def read_from_file():
             continue
           match = re.search(r'\b' + re.escape(city.lower()) + r'\b', text)
           if match:
-            if city in cities_df['city'][cities_df['iso2'] == 'GB'].values:
-              pass
-            else:
+            if city not in gb_cities:
               continue
             if 'createdAt' in data['commit']['record']:
               posted_at = data['commit']['record']['createdAt']
@@ -85,8 +278,24 @@ def read_from_file():
             global counts
             post_item = {'posted_at_timestamp': posted_at_timestamp, 'text': text}
             counts[city]['posts'].append(post_item) if city in counts else counts.update({city: {'posts': [post_item]}})
+            history.add(city, posted_at_timestamp)
+            n_matched += 1
             break
-  lock = False
+      match_seconds += time.perf_counter() - t1
+  if n_ingested:
+    metrics.observe('json_parse', parse_seconds)
+    metrics.observe('city_match', match_seconds)
+    metrics.inc('posts_ingested', n_ingested)
+    metrics.inc('posts_matched', n_matched)
+
+if not restore_state() and os.environ.get('CITYPULSE_HISTORY_SEED'):
+  # optionally seed per-topic history from a run_batch_analysis results file
+  with open(os.environ['CITYPULSE_HISTORY_SEED'], 'r', encoding='utf-8') as f:
+    add_batch_results(history, json.load(f))
 
 if __name__ == "__main__":
+    # ingest from startup rather than on the first request; with the debug
+    # reloader only the serving child (WERKZEUG_RUN_MAIN) runs the worker
+    if INGEST_WORKER and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_ingest_worker()
     app.run(debug=True, port=5001)
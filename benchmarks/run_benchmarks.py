@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the CityPulse hot paths.
+
+Runs without network or GPU: models are replaced by deterministic stub
+pipelines with a per-call and per-pair CPU cost (so batching effects show up),
+and all inputs are synthetic fixtures derived from `city_mentions.jsonl` and
+`api_1.json`.
+
+Cases
+  topic_single / topic_with_sentiment_single / topic_batched
+                      classify_citypulse_topic / classify_with_sentiment per post
+                      vs classify_batch_with_sentiment (posts/sec)
+  chs_aggregation     compute_topic_signed_scores + normalize + compute_CHS (posts/sec)
+  app_city_matching   app.read_from_file over a synthetic city_mentions.jsonl (lines/sec)
+  get_city_messages   src.get_city_messages over a synthetic dataset stream (posts/sec)
+  city_scores_<N>     app.calculate_city_scores with N live posts (posts/sec)
+  index_latency       GET / through the Flask test client (p50 / p95 ms)
+
+Usage
+  python benchmarks/run_benchmarks.py --out benchmarks/baseline.json
+  python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json --tolerance 0.15
+
+Cases whose dependencies are not installed, or that raise, are reported as skipped.
+Comparison mode exits with status 1 if any metric regressed beyond the tolerance.
+"""
+from pathlib import Path
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+API_PATH = ROOT / 'api_1.json'
+MENTIONS_PATH = ROOT / 'city_mentions.jsonl'
+
+# stands in for the nltk stopwords corpus, which app.py would otherwise download
+FIXTURE_STOPWORDS = '''i me my myself we our ours ourselves you your yours yourself yourselves he him his himself
+she her hers herself it its itself they them their theirs themselves what which who whom this that these those
+am is are was were be been being have has had having do does did doing a an the and but if or because as until
+while of at by for with about against between into through during before after above below to from up down in
+out on off over under again further then once here there when where why how all any both each few more most
+other some such no nor not only own same so than too very s t can will just don should now'''.split()
+
+# cities that are not in GB, so the app's iso2 filter has something to reject
+DISTRACTOR_CITIES = [('Paris', 'FR'), ('Berlin', 'DE'), ('Madrid', 'ES'), ('Toronto', 'CA'), ('Sydney', 'AU'), ('Chicago', 'US')]
+
+
+# ---- stub models -------------------------------------------------------------
+def _pseudo_score(*parts):
+    h = hashlib.md5('|'.join(parts).encode('utf-8')).digest()
+    return int.from_bytes(h[:4], 'little') / 2**32
+
+
+class _CostModel:
+    """Fixed CPU work per pipeline call + per input, standing in for a forward pass."""
+
+    def __init__(self, dim=64, call_dim=256, seed=0):
+        rng = np.random.default_rng(seed)
+        self.w = rng.standard_normal((dim, dim))
+        self.call_w = rng.standard_normal((call_dim, call_dim))
+
+    def spend(self, n_inputs):
+        np.tanh(self.call_w @ self.call_w)
+        np.tanh(np.ones((n_inputs, self.w.shape[0])) @ self.w)
+
+
+class StubZeroShot(_CostModel):
+    def __call__(self, sequences, candidate_labels, multi_label=True, batch_size=None):
+        single = isinstance(sequences, str)
+        texts = [sequences] if single else list(sequences)
+        self.spend(len(texts) * len(candidate_labels))
+        outs = []
+        for t in texts:
+            scored = sorted(((l, _pseudo_score(t, l)) for l in candidate_labels), key=lambda x: x[1], reverse=True)
+            outs.append({'sequence': t, 'labels': [l for l, _ in scored], 'scores': [s for _, s in scored]})
+        return outs[0] if single else outs
+
+
+class StubSentiment(_CostModel):
+    LABELS = ['negative', 'neutral', 'positive']
+
+    def __call__(self, texts, batch_size=None, top_k=1):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        self.spend(len(texts))
+        outs = []
+        for t in texts:
+            probs = np.array([_pseudo_score(t, l) for l in self.LABELS])
+            probs = probs / probs.sum()
+            dist = [{'label': l, 'score': float(p)} for l, p in zip(self.LABELS, probs)]
+            outs.append(dist)
+        if top_k is None:
+            return outs[0] if single else outs
+        # like the real pipeline: one top-label dict per input (a 1-element list for a str)
+        return [max(dist, key=lambda d: d['score']) for dist in outs]
+
+
+# ---- fixtures ----------------------------------------------------------------
+class Fixtures:
+    def __init__(self, workdir, seed=0):
+        self.rng = random.Random(seed)
+        self.workdir = Path(workdir)
+        with open(API_PATH, 'r', encoding='utf-8') as f:
+            api = json.load(f)
+        self.cities = [(c['city'], c['lat'], c['lng']) for c in api if c.get('city')]
+        self.texts = [p['text'] for c in api for p in c.get('posts', []) if p.get('text')]
+        self.templates = []
+        with open(MENTIONS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                data = json.loads(line)
+                if 'commit' in data and 'record' in data['commit']:
+                    self.templates.append(data)
+                if len(self.templates) >= 200:
+                    break
+
+    def sample_texts(self, n):
+        return [self.rng.choice(self.texts) for _ in range(n)]
+
+    def write_cities_csv(self):
+        path = self.workdir / 'worldcities.csv'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('city,lat,lng,iso2\n')
+            for city, lat, lng in self.cities:
+                f.write(f'"{city}",{lat},{lng},GB\n')
+            for city, iso2 in DISTRACTOR_CITIES:
+                f.write(f'"{city}",0.0,0.0,{iso2}\n')
+        return path
+
+    def write_mentions(self, n_lines, path=None):
+        """Real jetstream records as templates, with sampled texts and recent createdAt."""
+        path = Path(path or self.workdir / 'city_mentions.jsonl')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(n_lines):
+                rec = json.loads(json.dumps(self.rng.choice(self.templates)))
+                rec['commit']['record']['text'] = self.rng.choice(self.texts)
+                posted = now - datetime.timedelta(seconds=self.rng.randint(0, 3000))
+                rec['commit']['record']['createdAt'] = posted.isoformat()
+                f.write(json.dumps(rec) + '\n')
+        return path
+
+    def live_counts(self, n_posts):
+        """app.counts-shaped state with `n_posts` recent posts spread over the cities."""
+        now = int(datetime.datetime.now().timestamp())
+        counts = {}
+        for _ in range(n_posts):
+            city = self.rng.choice(self.cities)[0]
+            post = {'posted_at_timestamp': now - self.rng.randint(0, 3500), 'text': self.rng.choice(self.texts)}
+            counts.setdefault(city, {'posts': []})['posts'].append(post)
+        return counts
+
+    def classify_outputs(self, texts, categories):
+        outs = {}
+        for t in texts:
+            per_cat = {c: _pseudo_score(t, c) for c in categories}
+            best = max(per_cat, key=per_cat.get)
+            label = StubSentiment.LABELS[int(_pseudo_score(t, 'sent') * 3)]
+            outs[t] = {
+                'predicted_category': best if per_cat[best] >= 0.25 else 'none',
+                'category_score': per_cat[best],
+                'all_category_scores': per_cat,
+                'sentiment': {'label': label, 'score': _pseudo_score(t, label)},
+            }
+        return outs
+
+
+# ---- timing helpers ----------------------------------------------------------
+def timed(fn, repeat=3):
+    """Median wall time of `fn()` over `repeat` runs (after one warm-up)."""
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def rate(n, seconds, unit):
+    return {'value': n / seconds if seconds > 0 else float('inf'), 'unit': unit, 'higher_is_better': True, 'n': n}
+
+
+# ---- cases -------------------------------------------------------------------
+def _import_classifier():
+    # import without loading the real pipelines, then route the teacher code path through the stubs
+    os.environ['CITYPULSE_BACKEND'] = 'student'
+    import src.classify_sentiment as cs
+    cs.BACKEND = 'teacher'
+    cs.zshot = StubZeroShot(seed=1)
+    cs.sentiment_clf = StubSentiment(seed=2)
+    return cs
+
+
+def bench_topic(fx, args):
+    cs = _import_classifier()
+    texts = fx.sample_texts(args.n_classify)
+    results = {}
+    results['topic_single'] = rate(len(texts), timed(lambda: [cs.classify_citypulse_topic(t, topk_mean=3) for t in texts], args.repeat), 'posts/sec')
+    results['topic_with_sentiment_single'] = rate(len(texts), timed(lambda: [cs.classify_with_sentiment(t, topk_mean=3) for t in texts], args.repeat), 'posts/sec')
+    results['topic_batched'] = rate(len(texts), timed(
+        lambda: cs.classify_batch_with_sentiment(texts, topk_mean=3, batch_size=args.batch_size),
+        args.repeat), 'posts/sec')
+    return results
+
+
+def bench_chs(fx, args):
+    from src.CHS_computation import OECD_TOPICS, compute_topic_signed_scores, normalize_topic_scores_0_10, compute_CHS
+    texts = fx.sample_texts(args.n_aggregate)
+    outs = fx.classify_outputs(set(texts), sorted(OECD_TOPICS))
+
+    def run():
+        raw, _ = compute_topic_signed_scores(texts, lambda t, **_kw: outs[t])
+        compute_CHS(normalize_topic_scores_0_10(raw))
+    return {'chs_aggregation': rate(len(texts), timed(run, args.repeat), 'posts/sec')}
+
+
+def _import_app(fx, args):
+    os.environ['CITYPULSE_CITIES_CSV'] = str(fx.write_cities_csv())
+    os.environ['CITYPULSE_MENTIONS_FILE'] = str(fx.write_mentions(args.n_mentions))
+    # ingestion is driven explicitly below rather than by the background worker
+    os.environ['CITYPULSE_INGEST_WORKER'] = '0'
+    os.environ['CITYPULSE_STATE_DB'] = str(fx.workdir / 'live_state.db')
+    import nltk
+    # no network: app.py's nltk.download calls become no-ops and stopwords come from the fixture
+    corpus = fx.workdir / 'nltk_data' / 'corpora' / 'stopwords'
+    corpus.mkdir(parents=True, exist_ok=True)
+    (corpus / 'english').write_text('\n'.join(FIXTURE_STOPWORDS) + '\n', encoding='utf-8')
+    nltk.data.path.insert(0, str(fx.workdir / 'nltk_data'))
+    download = nltk.download
+    nltk.download = lambda *a, **kw: True
+    try:
+        import app
+    finally:
+        nltk.download = download
+    return app
+
+
+def bench_app(fx, args):
+    app = _import_app(fx, args)
+    results = {}
+
+    def match():
+        app.n_lines_read = 0
+        app.ingest_offset = 0
+        app.counts = {}
+        app.read_from_file()
+    results['app_city_matching'] = rate(args.n_mentions, timed(match, args.repeat), 'lines/sec')
+
+    for n in args.city_score_sizes:
+        state = fx.live_counts(n)
+
+        def score():
+            # calculate_city_scores mutates the post lists, so start from a fresh copy
+            app.counts = {c: {'posts': list(v['posts'])} for c, v in state.items()}
+            app.calculate_city_scores()
+        results[f'city_scores_{n}'] = rate(n, timed(score, args.repeat), 'posts/sec')
+
+    live = fx.live_counts(args.n_live)
+
+    def build():
+        app.counts = {c: {'posts': list(v['posts'])} for c, v in live.items()}
+        app.publish_snapshot()
+    results['snapshot_build'] = rate(args.n_live, timed(build, args.repeat), 'posts/sec')
+    results['checkpoint'] = rate(args.n_live, timed(app.checkpoint, args.repeat), 'posts/sec')
+    results['restore'] = rate(args.n_live, timed(app.restore_state, args.repeat), 'posts/sec')
+
+    client = app.app.test_client()
+    client.get('/')
+    lat = []
+    for _ in range(args.n_requests):
+        t0 = time.perf_counter()
+        resp = client.get('/')
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        assert resp.status_code == 200
+    lat.sort()
+    results['index_latency_p50'] = {'value': lat[len(lat) // 2], 'unit': 'ms', 'higher_is_better': False, 'n': len(lat)}
+    results['index_latency_p95'] = {'value': lat[int(len(lat) * 0.95) - 1], 'unit': 'ms', 'higher_is_better': False, 'n': len(lat)}
+    return results
+
+
+def bench_get_city_messages(fx, args):
+    import src.get_city_messages as gcm
+    rows = [{'text': t} for t in fx.sample_texts(args.n_stream)]
+    cities = [c for c, _, _ in fx.cities]
+    original = gcm.load_dataset
+    # the dataset is streamed from the hub in production; feed the synthetic rows instead
+    gcm.load_dataset = lambda *a, **kw: iter(rows)
+    try:
+        secs = timed(lambda: gcm.get_city_messages(len(rows), cities), args.repeat)
+    finally:
+        gcm.load_dataset = original
+    return {'get_city_messages': rate(len(rows), secs, 'posts/sec')}
+
+
+CASES = {
+    'topic': bench_topic,
+    'chs': bench_chs,
+    'app': bench_app,
+    'get_city_messages': bench_get_city_messages,
+}
+
+
+# ---- compare -----------------------------------------------------------------
+def compare(current, baseline, tolerance, cases=None):
+    """
+    Return list of (name, baseline, current, change) for metrics worse than
+    `tolerance`, plus (name, baseline, None, None) for baseline metrics the
+    current run did not produce and (case, None, None, None) for newly skipped
+    cases. `cases`: the cases that were run, if not all of them (--only).
+    """
+    regressions = []
+    for name, cur in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or base['value'] in (0, None):
+            continue
+        change = (cur['value'] - base['value']) / base['value']
+        worse = -change if cur['higher_is_better'] else change
+        flag = 'REGRESSION' if worse > tolerance else ''
+        print(f"{name:32s} {base['value']:12.2f} -> {cur['value']:12.2f} {cur['unit']:10s} {change:+7.1%} {flag}")
+        if flag:
+            regressions.append((name, base['value'], cur['value'], change))
+    for name, base in baseline.get('results', {}).items():
+        if name in current['results']:
+            continue
+        # with --only, metrics of the cases left out are not missing
+        if cases is not None and base.get('case') not in cases:
+            continue
+        print(f"{name:32s} {base['value']:12.2f} -> {'missing':>12s} {base['unit']:10s} {'':7s} REGRESSION")
+        regressions.append((name, base['value'], None, None))
+    for name, reason in current.get('skipped', {}).items():
+        if name not in baseline.get('skipped', {}):
+            print(f"{name:32s} newly skipped: {reason}")
+            regressions.append((name, None, None, None))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline CityPulse benchmark suite')
+    parser.add_argument('--out', default=None, help='Write results JSON here')
+    parser.add_argument('--compare', default=None, help='Baseline results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative slowdown before flagging a regression')
+    parser.add_argument('--only', default=None, help=f'Comma-separated subset of: {", ".join(CASES)}')
+    parser.add_argument('--quick', action='store_true', help='Smaller inputs for a fast smoke run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32, dest='batch_size')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    args.n_classify = max(8, int(200 * scale))
+    args.n_aggregate = max(100, int(20000 * scale))
+    args.n_mentions = max(100, int(5000 * scale))
+    args.n_stream = max(100, int(20000 * scale))
+    args.n_live = max(100, int(2000 * scale))
+    args.n_requests = max(10, int(100 * scale))
+    args.city_score_sizes = [max(100, int(n * scale)) for n in (1000, 10000, 100000)]
+
+    selected = args.only.split(',') if args.only else list(CASES)
+    out = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'quick': args.quick,
+            'seed': args.seed,
+        },
+        'results': {},
+        'skipped': {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        fx = Fixtures(workdir, seed=args.seed)
+        for name in selected:
+            try:
+                res = CASES[name](fx, args)
+            except ImportError as e:
+                out['skipped'][name] = f'missing dependency: {e}'
+                print(f"[skip] {name}: {e}")
+                continue
+            except Exception as e:
+                # one broken case should not lose the other cases' results
+                out['skipped'][name] = f'failed: {type(e).__name__}: {e}'
+                print(f"[fail] {name}: {type(e).__name__}: {e}")
+                continue
+            for v in res.values():
+                v['case'] = name
+            out['results'].update(res)
+            for k, v in res.items():
+                print(f"{k:32s} {v['value']:12.2f} {v['unit']}")
+
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(out, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nComparison against {args.compare} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(out, baseline, args.tolerance, cases=selected if args.only else None)
+        if regressions:
+            print(f"{len(regressions)} regression(s) or missing result(s)")
+            sys.exit(1)
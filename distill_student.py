@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Distil the CityPulse teacher pipelines (roberta-large-mnli zero-shot over every
+OECD keyword + twitter-roberta sentiment) into a compact single-pass student.
+
+Steps (each resumable / re-runnable on its own):
+  label  : run the teachers over the city post corpus (api_1.json + city_mentions.jsonl)
+           and cache their raw outputs in results/teacher_cache.jsonl, keyed by text hash
+  train  : train src.student_model.CityPulseStudent on the cached teacher outputs
+  report : agreement + throughput of the student against the cached teacher outputs
+
+Use the trained student with CITYPULSE_BACKEND=student (see src/classify_sentiment.py).
+"""
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+
+try:
+    from tqdm import tqdm
+except Exception:
+    def tqdm(x, **_kw):
+        return x
+
+import numpy as np
+
+ROOT = Path('.')
+API_PATH = ROOT / 'api_1.json'
+MENTIONS_PATH = ROOT / 'city_mentions.jsonl'
+OUT_DIR = ROOT / 'results'
+CACHE_FILE = OUT_DIR / 'teacher_cache.jsonl'
+TEACHER_META_FILE = OUT_DIR / 'teacher_meta.json'
+REPORT_FILE = OUT_DIR / 'student_report.json'
+MODEL_DIR = ROOT / 'models' / 'citypulse_student'
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def is_holdout(key, holdout_pct=10):
+    """Deterministic train/holdout split on the text hash."""
+    return int(key[:8], 16) % 100 < holdout_pct
+
+
+def load_corpus():
+    """
+    Returns (texts, city_texts):
+      texts: unique post texts from api_1.json and city_mentions.jsonl
+      city_texts: dict[city] -> list of texts from api_1.json (for per-city CHS agreement)
+    """
+    texts, seen = [], set()
+    city_texts = {}
+
+    def _add(t):
+        if t and t not in seen:
+            seen.add(t)
+            texts.append(t)
+
+    if API_PATH.exists():
+        with open(API_PATH, 'r', encoding='utf-8') as f:
+            for city in json.load(f):
+                city_posts = [p.get('text', '') for p in city.get('posts', []) or [] if p.get('text')]
+                city_texts[city.get('city')] = city_posts
+                for t in city_posts:
+                    _add(t)
+    if MENTIONS_PATH.exists():
+        with open(MENTIONS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                _add(data.get('commit', {}).get('record', {}).get('text', '').lower())
+    return texts, city_texts
+
+
+def load_cache():
+    cache = {}
+    if CACHE_FILE.exists():
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                cache[row['key']] = row
+    return cache
+
+
+def category_score(label_scores, topk_mean):
+    """Same aggregation as score_category: top-k mean (or max) of the keyword scores."""
+    vals = sorted(label_scores.values(), reverse=True)
+    if topk_mean and topk_mean > 1:
+        return float(np.mean(vals[:min(topk_mean, len(vals))]))
+    return float(vals[0])
+
+
+def teacher_output(row, topk_mean=3, threshold=0.25):
+    """Rebuild a classify_with_sentiment-shaped dict from a cached teacher row."""
+    per_cat = {cat: category_score(ls, topk_mean) for cat, ls in row['category_label_scores'].items()}
+    best_cat, best_score = max(per_cat.items(), key=lambda kv: kv[1])
+    label_scores = sorted(row['category_label_scores'][best_cat].items(), key=lambda x: x[1], reverse=True)
+    sent_label, sent_score = max(row['sentiment'].items(), key=lambda kv: kv[1])
+    return {
+        "predicted_category": best_cat if best_score >= threshold else "none",
+        "category_score": best_score,
+        "top_keyword": label_scores[0][0],
+        "all_category_scores": per_cat,
+        "explanation_top3_keywords": label_scores[:3],
+        "sentiment": {"label": sent_label, "score": sent_score},
+    }
+
+
+# ---- label -------------------------------------------------------------------
+def cmd_label(args):
+    import src.classify_sentiment as cs
+    if cs.BACKEND != 'teacher':
+        raise RuntimeError('Labelling needs the teacher pipelines (unset CITYPULSE_BACKEND or set it to "teacher").')
+
+    texts, _ = load_corpus()
+    cache = load_cache()
+    todo = [t for t in texts if text_key(t) not in cache]
+    if args.limit:
+        todo = todo[:args.limit]
+    print(f"{len(texts)} corpus texts, {len(cache)} cached, labelling {len(todo)}")
+
+    OUT_DIR.mkdir(exist_ok=True)
+    n_done, t0 = 0, time.perf_counter()
+    with open(CACHE_FILE, 'a', encoding='utf-8') as fout:
+        for start in tqdm(range(0, len(todo), args.batch_size), desc='Teacher batches'):
+            batch = todo[start:start + args.batch_size]
+            rows = [{'key': text_key(t), 'text': t, 'category_label_scores': {}, 'sentiment': {}} for t in batch]
+            for cat, labels in cs.OECD_CATEGORIES.items():
+                results = cs.zshot(batch, candidate_labels=labels, multi_label=True, batch_size=args.batch_size)
+                for row, out in zip(rows, results):
+                    row['category_label_scores'][cat] = dict(zip(out['labels'], map(float, out['scores'])))
+            sent = cs.sentiment_clf(batch, top_k=None, batch_size=args.batch_size)
+            for row, dist in zip(rows, sent):
+                row['sentiment'] = {d['label'].lower(): float(d['score']) for d in dist}
+            # one line per text, flushed per batch so an interrupted run resumes where it stopped
+            for row in rows:
+                fout.write(json.dumps(row, ensure_ascii=False) + '\n')
+            fout.flush()
+            n_done += len(batch)
+
+    elapsed = time.perf_counter() - t0
+    if n_done:
+        meta = {'teacher_posts_per_sec': n_done / elapsed, 'n_labelled': n_done, 'batch_size': args.batch_size}
+        with open(TEACHER_META_FILE, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        print(f"Teacher throughput: {meta['teacher_posts_per_sec']:.2f} posts/sec")
+
+
+# ---- train -------------------------------------------------------------------
+def _targets(rows, categories, keywords, topk_mean):
+    from src.student_model import SENTIMENT_LABELS
+    topic = np.array([[category_score(r['category_label_scores'][c], topk_mean) for c in categories] for r in rows], dtype=np.float32)
+    sent = np.array([[r['sentiment'].get(l, 0.0) for l in SENTIMENT_LABELS] for r in rows], dtype=np.float32)
+    kw = np.array([[r['category_label_scores'][c].get(k, 0.0) for c, k in keywords] for r in rows], dtype=np.float32)
+    return topic, sent, kw
+
+
+def cmd_train(args):
+    # only the keyword lists are needed here, so skip loading the teacher pipelines
+    os.environ['CITYPULSE_BACKEND'] = 'student'
+    import torch
+    import torch.nn.functional as F
+    from transformers import AutoTokenizer
+    from src.classify_sentiment import OECD_CATEGORIES
+    from src.student_model import ENCODER_SUBDIR, CityPulseStudent, keyword_index
+
+    torch.manual_seed(args.seed)
+    random.seed(args.seed)
+
+    cache = load_cache()
+    rows = [r for k, r in cache.items() if not is_holdout(k, args.holdout_pct)]
+    if not rows:
+        raise RuntimeError(f'No cached teacher outputs in {CACHE_FILE}; run `label` first.')
+    categories = list(OECD_CATEGORIES.keys())
+    keywords = keyword_index(OECD_CATEGORIES)
+    topic_t, sent_t, kw_t = _targets(rows, categories, keywords, args.topk_mean)
+    texts = [r['text'] for r in rows]
+    print(f"Training on {len(rows)} teacher-labelled posts ({len(cache) - len(rows)} held out)")
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    tokenizer = AutoTokenizer.from_pretrained(args.encoder)
+    model = CityPulseStudent(args.encoder, categories, len(keywords)).to(device)
+    opt = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=0.01)
+
+    order = list(range(len(rows)))
+    for epoch in range(args.epochs):
+        random.shuffle(order)
+        model.train()
+        total = 0.0
+        for start in tqdm(range(0, len(order), args.batch_size), desc=f'Epoch {epoch + 1}/{args.epochs}'):
+            idx = order[start:start + args.batch_size]
+            enc = tokenizer([texts[i] for i in idx], padding=True, truncation=True, max_length=args.max_length, return_tensors='pt').to(device)
+            out = model(enc['input_ids'], enc['attention_mask'])
+            # soft-target distillation: sigmoid targets for topic/keyword scores, KL for sentiment
+            loss_topic = F.binary_cross_entropy_with_logits(out['topic_logits'], torch.from_numpy(topic_t[idx]).to(device))
+            loss_kw = F.binary_cross_entropy_with_logits(out['keyword_logits'], torch.from_numpy(kw_t[idx]).to(device))
+            loss_sent = F.kl_div(F.log_softmax(out['sentiment_logits'], dim=-1), torch.from_numpy(sent_t[idx]).to(device), reduction='batchmean')
+            loss = loss_topic + loss_sent + args.keyword_weight * loss_kw
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            total += float(loss) * len(idx)
+        print(f"epoch {epoch + 1}: loss={total / len(order):.4f}")
+
+    model_dir = Path(args.model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    torch.save(model.state_dict(), model_dir / 'student.pt')
+    tokenizer.save_pretrained(model_dir)
+    # lets StudentClassifier build the encoder without fetching the pretrained weights
+    model.encoder.config.save_pretrained(model_dir / ENCODER_SUBDIR)
+    with open(model_dir / 'config.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'encoder': args.encoder,
+            'categories': categories,
+            'keywords': keywords,
+            'max_length': args.max_length,
+            'topk_mean': args.topk_mean,
+        }, f, indent=2)
+    print(f"Saved student to {model_dir}")
+
+
+# ---- report ------------------------------------------------------------------
+def cmd_report(args):
+    os.environ['CITYPULSE_BACKEND'] = 'student'
+    from src.CHS_computation import normalize_topic_scores_0_10, compute_CHS
+    from src.budgeted_sampling import TOPIC_ORDER, signed_contributions
+    from src.student_model import StudentClassifier
+
+    cache = load_cache()
+    holdout = [r for k, r in cache.items() if is_holdout(k, args.holdout_pct)]
+    if not holdout:
+        raise RuntimeError('No held-out teacher outputs to compare against.')
+    texts = [r['text'] for r in holdout]
+
+    student = StudentClassifier(args.model_dir)
+    student.classify_batch(texts[:args.batch_size], topk_mean=args.topk_mean, batch_size=args.batch_size)  # warm-up
+    t0 = time.perf_counter()
+    s_outs = student.classify_batch(texts, topk_mean=args.topk_mean, threshold=args.threshold, batch_size=args.batch_size)
+    student_pps = len(texts) / (time.perf_counter() - t0)
+    t_outs = [teacher_output(r, topk_mean=args.topk_mean, threshold=args.threshold) for r in holdout]
+
+    topic_agree = np.mean([s['predicted_category'] == t['predicted_category'] for s, t in zip(s_outs, t_outs)])
+    top1_agree = np.mean([
+        max(s['all_category_scores'], key=s['all_category_scores'].get) == max(t['all_category_scores'], key=t['all_category_scores'].get)
+        for s, t in zip(s_outs, t_outs)
+    ])
+    sent_agree = np.mean([s['sentiment']['label'] == t['sentiment']['label'].lower() for s, t in zip(s_outs, t_outs)])
+    score_mae = np.mean([
+        abs(s['all_category_scores'][c] - t['all_category_scores'][c])
+        for s, t in zip(s_outs, t_outs) for c in t['all_category_scores']
+    ])
+
+    # per-city CHS agreement; held-out posts only for the headline figures, all cached
+    # posts (including the student's training data) reported separately
+    _, city_texts = load_corpus()
+
+    def city_chs(outs):
+        # same aggregation as run_batch_analysis: per-topic mean of sign(sentiment) * category_score
+        cats, vals = signed_contributions(outs)
+        raw = {t: float(vals[cats == i].mean()) if (cats == i).any() else 0.0 for i, t in enumerate(TOPIC_ORDER)}
+        return compute_CHS(normalize_topic_scores_0_10(raw))
+
+    def city_chs_diffs(rows):
+        by_text = {r['text']: r for r in rows}
+        diffs = []
+        for city, ctexts in city_texts.items():
+            ctexts = [t for t in ctexts if t in by_text]
+            if not ctexts:
+                continue
+            s_outs_city = student.classify_batch(ctexts, topk_mean=args.topk_mean, threshold=args.threshold, batch_size=args.batch_size)
+            t_outs_city = [teacher_output(by_text[t], topk_mean=args.topk_mean, threshold=args.threshold) for t in ctexts]
+            diffs.append(abs(city_chs(s_outs_city) - city_chs(t_outs_city)))
+        return diffs
+
+    chs_diffs = city_chs_diffs(holdout)
+    chs_diffs_all = city_chs_diffs(cache.values())
+
+    teacher_pps = None
+    if TEACHER_META_FILE.exists():
+        with open(TEACHER_META_FILE, 'r', encoding='utf-8') as f:
+            teacher_pps = json.load(f).get('teacher_posts_per_sec')
+
+    report = {
+        'n_holdout': len(holdout),
+        'topic_agreement': float(topic_agree),
+        'topic_top1_agreement': float(top1_agree),
+        'sentiment_agreement': float(sent_agree),
+        'category_score_mae': float(score_mae),
+        'city_chs_mae': float(np.mean(chs_diffs)) if chs_diffs else None,
+        'city_chs_max_abs_diff': float(np.max(chs_diffs)) if chs_diffs else None,
+        'n_cities_holdout': len(chs_diffs),
+        'city_chs_mae_all_posts': float(np.mean(chs_diffs_all)) if chs_diffs_all else None,
+        'city_chs_max_abs_diff_all_posts': float(np.max(chs_diffs_all)) if chs_diffs_all else None,
+        'student_posts_per_sec': student_pps,
+        'teacher_posts_per_sec': teacher_pps,
+        'speedup': student_pps / teacher_pps if teacher_pps else None,
+    }
+    OUT_DIR.mkdir(exist_ok=True)
+    with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for k, v in report.items():
+        print(f"{k}: {v}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distil the CityPulse teacher pipelines into a compact student')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('label', help='Run teachers over the corpus and cache outputs')
+    p.add_argument('--batch-size', type=int, default=32, dest='batch_size', help='Teacher batch size')
+    p.add_argument('--limit', type=int, default=None, help='Label at most this many new texts')
+    p.set_defaults(func=cmd_label)
+
+    p = sub.add_parser('train', help='Train the student on cached teacher outputs')
+    p.add_argument('--encoder', default='google/bert_uncased_L-4_H-256_A-4', help='Pretrained encoder for the student')
+    p.add_argument('--model-dir', default=str(MODEL_DIR), dest='model_dir')
+    p.add_argument('--epochs', type=int, default=5)
+    p.add_argument('--batch-size', type=int, default=32, dest='batch_size')
+    p.add_argument('--lr', type=float, default=5e-5)
+    p.add_argument('--max-length', type=int, default=128, dest='max_length')
+    p.add_argument('--keyword-weight', type=float, default=0.5, dest='keyword_weight', help='Loss weight of the keyword head')
+    p.add_argument('--topk-mean', type=int, default=3, dest='topk_mean', help='Top-k mean used to build category targets')
+    p.add_argument('--holdout-pct', type=int, default=10, dest='holdout_pct')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser('report', help='Agreement and throughput of the student vs the teachers')
+    p.add_argument('--model-dir', default=str(MODEL_DIR), dest='model_dir')
+    p.add_argument('--batch-size', type=int, default=64, dest='batch_size')
+    p.add_argument('--topk-mean', type=int, default=3, dest='topk_mean')
+    p.add_argument('--threshold', type=float, default=0.25)
+    p.add_argument('--holdout-pct', type=int, default=10, dest='holdout_pct')
+    p.set_defaults(func=cmd_report)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,15 +1,235 @@
-from transformers import pipeline
+"""
+Emotion scoring stage for api_1.json posts.
+
+- batched inference through the distilbert emotion classifier (`--batch-size`)
+- per-post results are cached in emotion_cache.jsonl keyed by text hash, so a
+  rerun resumes where it stopped instead of appending duplicate cities
+- emotions.jsonl (one line per city, posts with `emotions`) is rebuilt from the
+  cache and atomically replaced at the end of every run
+- `--with-chs` also runs the OECD topic + sentiment classification
+  (src.classify_sentiment) on the same batches, so posts are read once, and adds
+  per-post `classification` and per-city `overall_topic_scores_0_10` / `overall_chs`;
+  cached classifications made with other `--topk-mean` / `--threshold` are redone
+- posts/sec is reported per stage
+- `--update-lexicon` feeds scored posts into the emotion_words.py term counts; the
+  saved lexicon records which posts it has counted, so posts scored after its last
+  save (an interrupted run, or a run without `--update-lexicon`) are fed in on the
+  next run, and none is counted twice
+"""
+from collections import defaultdict
+from pathlib import Path
+import argparse
 import json
+import os
+import sys
+import time
+
 import tqdm
 
-classifier = pipeline("text-classification",model='bhadresh-savani/distilbert-base-uncased-emotion', return_all_scores=True)
-
-data = json.load(open('api_1.json', 'r'))
-for city in data:
-    for post in tqdm.tqdm(city['posts']):
-        text = post['text']
-        results = classifier(text)
-        emotions = {item['label']: item['score'] for item in results[0]}
-        post['emotions'] = emotions
-    with open('emotions.jsonl', 'a', encoding='utf-8') as outfile:
-        outfile.write(json.dumps(city) + '\n')
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(ROOT))
+from src import metrics  # needs ROOT on sys.path
+from emotion_words import post_key
+
+DATA_PATH = ROOT / 'api_1.json'
+OUT_FILE = HERE / 'emotions.jsonl'
+CACHE_FILE = HERE / 'emotion_cache.jsonl'
+PROFILE_FILE = HERE / 'emotions.profile.json'
+
+EMOTION_MODEL = 'bhadresh-savani/distilbert-base-uncased-emotion'
+
+
+def load_cache():
+    """key -> row; later lines win, so re-written rows override earlier ones."""
+    cache = {}
+    # seed from an emotions.jsonl written before the cache existed
+    if OUT_FILE.exists():
+        with open(OUT_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    city = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                for post in city.get('posts', []):
+                    if post.get('emotions'):
+                        k = post_key(post['text'])
+                        cache[k] = {'key': k, 'emotions': post['emotions']}
+    if CACHE_FILE.exists():
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by an interrupted run
+                    continue
+                cache[row['key']] = {**cache.get(row['key'], {}), **row}
+    return cache
+
+
+def write_atomic(path, lines):
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+    os.replace(partial, path)
+
+
+def build_emotion_fn():
+    """Returns emotion_fn(texts, batch_size) -> list of {emotion: score}."""
+    if os.environ.get('CITYPULSE_BACKEND') == 'remote':
+        from src.inference_client import default_client
+        return lambda texts, batch_size: default_client().emotions(texts)
+
+    from transformers import pipeline
+    classifier = pipeline("text-classification", model=EMOTION_MODEL, top_k=None)
+
+    def emotion_fn(texts, batch_size):
+        results = classifier(texts, batch_size=batch_size, truncation=True)
+        return [{item['label']: item['score'] for item in res} for res in results]
+    return emotion_fn
+
+
+class StageTimer:
+    def __init__(self):
+        self.posts = {}
+        self.seconds = {}
+
+    def run(self, stage, fn, texts, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(texts, *args, **kwargs) if texts else []
+        elapsed = time.perf_counter() - t0
+        metrics.observe(stage, elapsed)
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+        self.posts[stage] = self.posts.get(stage, 0) + len(texts)
+        return out
+
+    def report(self):
+        for stage, n in self.posts.items():
+            secs = self.seconds[stage]
+            print(f"{stage}: {n} posts in {secs:.1f}s ({n / secs if secs > 0 else 0.0:.2f} posts/sec)")
+
+
+def main(args):
+    with open(DATA_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    cache = load_cache()
+    # options a cached classification has to match to be reused
+    chs_opts = {'topk_mean': args.topk_mean, 'threshold': args.threshold}
+
+    def needs_chs(row):
+        return args.with_chs and ('classification' not in row or row.get('classification_opts') != chs_opts)
+
+    texts, text_of = [], {}
+    cities_of = defaultdict(list)
+    for city in data:
+        for post in city['posts']:
+            t = post['text']
+            k = post_key(t)
+            cities_of[k].append(city['city'])
+            if k in text_of:
+                continue
+            text_of[k] = t
+            row = cache.get(k, {})
+            if 'emotions' not in row or needs_chs(row):
+                texts.append(t)
+    print(f"{len(text_of)} unique posts, {len(text_of) - len(texts)} already scored, {len(texts)} to do")
+    metrics.inc('posts_ingested', len(text_of))
+    metrics.inc('posts_cached', len(text_of) - len(texts), cache='emotion')
+
+    if args.update_lexicon:
+        from emotion_words import TermCounts, load_stop_words
+        lexicon = TermCounts.load(load_stop_words())
+
+        def count_post(k, emotions):
+            # once per city the post was matched to, like emotion_words.py --rebuild
+            for city_name in cities_of[k]:
+                lexicon.add_post(city_name, text_of[k], emotions)
+            lexicon.counted.add(k)
+
+        # posts scored earlier that the saved lexicon has not counted yet
+        pending = [k for k in text_of if k not in lexicon.counted and cache.get(k, {}).get('emotions')]
+        for k in pending:
+            count_post(k, cache[k]['emotions'])
+        if pending:
+            print(f"fed {len(pending)} already scored posts into the lexicon")
+
+    timer = StageTimer()
+    if texts:
+        emotion_fn = build_emotion_fn()
+        if args.with_chs:
+            import src.classify_sentiment as cs
+
+        chunk = args.batch_size * args.flush_every
+        with open(CACHE_FILE, 'a', encoding='utf-8') as fcache:
+            for i_chunk, start in enumerate(tqdm.tqdm(range(0, len(texts), chunk), desc='Emotion batches')):
+                batch = texts[start:start + chunk]
+                keys = [post_key(t) for t in batch]
+                rows = {k: {'key': k} for k in keys}
+
+                need = [(k, t) for k, t in zip(keys, batch) if 'emotions' not in cache.get(k, {})]
+                emos = timer.run('emotion', emotion_fn, [t for _, t in need], args.batch_size)
+                for (k, t), emo in zip(need, emos):
+                    rows[k]['emotions'] = emo
+                    if args.update_lexicon:
+                        count_post(k, emo)
+
+                if args.with_chs:
+                    need = [(k, t) for k, t in zip(keys, batch) if needs_chs(cache.get(k, {}))]
+                    outs = timer.run(
+                        'topic+sentiment', cs.classify_batch_with_sentiment, [t for _, t in need],
+                        topk_mean=args.topk_mean, threshold=args.threshold, batch_size=args.batch_size,
+                    )
+                    for (k, _), out in zip(need, outs):
+                        rows[k]['classification'] = out
+                        rows[k]['classification_opts'] = chs_opts
+
+                for k, row in rows.items():
+                    cache[k] = {**cache.get(k, {}), **row}
+                    fcache.write(json.dumps(row, ensure_ascii=False) + '\n')
+                fcache.flush()
+                # the cache rows above are flushed first, so the saved lexicon never counts a post the cache lost
+                if args.update_lexicon and (i_chunk + 1) % args.lexicon_save_every == 0:
+                    lexicon.save()
+    if args.update_lexicon:
+        lexicon.save()
+
+    # compact the cache and rebuild the per-city output (no duplicates on rerun)
+    write_atomic(CACHE_FILE, (json.dumps(row, ensure_ascii=False) for row in cache.values()))
+    if args.with_chs:
+        from src.CHS_computation import normalize_topic_scores_0_10, compute_CHS
+        from src.budgeted_sampling import TOPIC_ORDER, signed_contributions
+
+    lines = []
+    for city in data:
+        for post in city['posts']:
+            row = cache.get(post_key(post['text']), {})
+            post['emotions'] = row.get('emotions')
+            if args.with_chs:
+                post['classification'] = row.get('classification')
+        if args.with_chs:
+            # same aggregation as run_batch_analysis: per-topic mean of sign(sentiment) * category_score over every post
+            cats, vals = signed_contributions([p['classification'] for p in city['posts'] if p.get('classification')])
+            raw = {t: float(vals[cats == i].mean()) if (cats == i).any() else 0.0 for i, t in enumerate(TOPIC_ORDER)}
+            city['overall_topic_scores_0_10'] = normalize_topic_scores_0_10(raw)
+            city['overall_chs'] = compute_CHS(city['overall_topic_scores_0_10'])
+        lines.append(json.dumps(city))
+    with metrics.timer('output_write'):
+        write_atomic(OUT_FILE, lines)
+    metrics.write_profile_summary(PROFILE_FILE)
+
+    timer.report()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched, resumable emotion scoring (optionally with OECD topic + sentiment)')
+    parser.add_argument('--batch-size', type=int, default=32, dest='batch_size', help='Model batch size')
+    parser.add_argument('--flush-every', type=int, default=8, dest='flush_every', help='Batches between cache flushes')
+    parser.add_argument('--with-chs', action='store_true', dest='with_chs', help='Also run topic + sentiment scoring in the same pass')
+    parser.add_argument('--update-lexicon', action='store_true', dest='update_lexicon', help='Feed newly scored posts into the emotion_words.py term counts')
+    parser.add_argument('--lexicon-save-every', type=int, default=16, dest='lexicon_save_every', help='Cache flushes between lexicon saves')
+    parser.add_argument('--topk-mean', type=int, default=3, dest='topk_mean', help='Top-k mean for category score aggregation')
+    parser.add_argument('--threshold', type=float, default=0.25, dest='threshold', help='Category confidence threshold')
+    args = parser.parse_args()
+    main(args)
@@ -1,32 +1,212 @@
+"""
+Positive / negative emotion lexicon from emotion-scored posts.
+
+Streaming term-count engine:
+- each qualifying post is tokenized once with a regex tokenizer
+- sparse per-polarity counts are kept globally and per city, each counter
+  capped at a fixed number of terms (lowest counts are pruned), so memory stays
+  bounded however many posts are streamed through
+- words are ranked by weighted log-odds with an informative Dirichlet prior
+  (Monroe et al. 2008) and a minimum frequency, instead of set subtraction
+- counts are saved to lexicon_state.json together with the keys (text hashes)
+  of the posts already counted; emotion.py --update-lexicon feeds in every scored
+  post not counted yet, `--rebuild` streams emotions.jsonl from scratch
+"""
+from collections import Counter
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+
 negative_emotions = ['sadness', 'anger', 'fear']
 positive_emotions = ['joy', 'love']
 
-import json
-import nltk
-nltk.download('stopwords')
-from nltk.corpus import stopwords
-stop_words = set(stopwords.words('english'))
-import shap
-
-positive_words = set()
-negative_words = set()
-
-with open('emotions.jsonl', 'r') as f:
-    for line in f:
-        city = json.loads(line)
-        for post in city['posts']:
-            emotions = post['emotions']
-            neg_score = sum([emotions[emo] for emo in negative_emotions])
-            pos_score = sum([emotions[emo] for emo in positive_emotions])
-            if neg_score < 0.9 and pos_score < 0.9:
+HERE = Path(__file__).resolve().parent
+EMOTIONS_FILE = HERE / 'emotions.jsonl'
+STATE_FILE = HERE / 'lexicon_state.json'
+
+TOKEN_RE = re.compile(r"[^\W\d_]+")
+POLARITIES = ('positive', 'negative')
+
+
+def post_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def load_stop_words():
+    try:
+        from nltk.corpus import stopwords
+        return set(stopwords.words('english'))
+    except LookupError:
+        import nltk
+        nltk.download('stopwords')
+        from nltk.corpus import stopwords
+        return set(stopwords.words('english'))
+
+
+def post_polarity(emotions, min_score=0.9):
+    """'positive' / 'negative' for confidently emotional posts, else None."""
+    if not emotions:
+        return None
+    neg_score = sum(emotions.get(emo, 0.0) for emo in negative_emotions)
+    pos_score = sum(emotions.get(emo, 0.0) for emo in positive_emotions)
+    if neg_score < min_score and pos_score < min_score:
+        return None
+    return 'negative' if neg_score > pos_score else 'positive'
+
+
+class TermCounts:
+    def __init__(self, stop_words, max_terms=200_000, max_city_terms=20_000):
+        self.stop_words = stop_words
+        self.max_terms = max_terms
+        self.max_city_terms = max_city_terms
+        self.counts = {p: Counter() for p in POLARITIES}
+        self.city_counts = {}
+        self.city_totals = {}
+        # token totals are tracked separately so pruning does not skew the odds
+        self.totals = {p: 0 for p in POLARITIES}
+        self.n_posts = {p: 0 for p in POLARITIES}
+        # post_key() of every post already counted (see emotion.py --update-lexicon)
+        self.counted = set()
+
+    def tokenize(self, text):
+        return [w for w in TOKEN_RE.findall(text.lower()) if w not in self.stop_words]
+
+    def add_post(self, city, text, emotions):
+        polarity = post_polarity(emotions)
+        if polarity is None:
+            return
+        tokens = self.tokenize(text)
+        self.n_posts[polarity] += 1
+        self.totals[polarity] += len(tokens)
+
+        glob = self.counts[polarity]
+        glob.update(tokens)
+        if len(glob) > self.max_terms:
+            self._prune(glob, self.max_terms)
+
+        if city is not None:
+            per_city = self.city_counts.setdefault(city, {p: Counter() for p in POLARITIES})[polarity]
+            per_city.update(tokens)
+            city_totals = self.city_totals.setdefault(city, {p: 0 for p in POLARITIES})
+            city_totals[polarity] += len(tokens)
+            if len(per_city) > self.max_city_terms:
+                self._prune(per_city, self.max_city_terms)
+
+    @staticmethod
+    def _prune(counter, limit):
+        """Keep the 3/4 * `limit` most frequent terms (amortised O(1) per token)."""
+        kept = counter.most_common(int(limit * 0.75))
+        counter.clear()
+        counter.update(dict(kept))
+
+    def update_from_emotions_file(self, path=EMOTIONS_FILE):
+        """Stream an emotions.jsonl (one city per line) into the counts."""
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                city = json.loads(line)
+                for post in city['posts']:
+                    if post.get('emotions'):
+                        self.add_post(city['city'], post['text'], post['emotions'])
+                        self.counted.add(post_key(post['text']))
+
+    def log_odds(self, city=None, min_count=5, prior_strength=500.0):
+        """
+        Weighted log-odds (z-scores) of positive vs negative usage per word.
+        city=None ranks over all posts; otherwise over that city's posts with the
+        global counts as the prior. Positive z -> positive word.
+        """
+        if city is None:
+            pos, neg = self.counts['positive'], self.counts['negative']
+            n_pos, n_neg = self.totals['positive'], self.totals['negative']
+        else:
+            cc = self.city_counts.get(city, {p: Counter() for p in POLARITIES})
+            pos, neg = cc['positive'], cc['negative']
+            totals = self.city_totals.get(city, {p: 0 for p in POLARITIES})
+            n_pos, n_neg = totals['positive'], totals['negative']
+
+        prior = self.counts['positive'] + self.counts['negative']
+        prior_total = sum(prior.values()) or 1
+        a0 = prior_strength
+
+        scores = {}
+        for w in set(pos) | set(neg):
+            y_p, y_n = pos.get(w, 0), neg.get(w, 0)
+            if y_p + y_n < min_count:
                 continue
-            if neg_score > pos_score:
-                negative_words.update([word for word in nltk.word_tokenize(post['text'].lower()) if word.isalpha() and word not in stop_words])
-            else:
-                positive_words.update([word for word in nltk.word_tokenize(post['text'].lower()) if word.isalpha() and word not in stop_words])
-
-neutral_words = positive_words & negative_words
-positive_words = positive_words - neutral_words
-negative_words = negative_words - neutral_words
-print("Positive words:", ', '.join(positive_words))
-print("Negative words:", ', '.join(negative_words))
+            a_w = a0 * prior.get(w, 0) / prior_total or 1e-3
+            delta = (math.log((y_p + a_w) / (n_pos + a0 - y_p - a_w))
+                     - math.log((y_n + a_w) / (n_neg + a0 - y_n - a_w)))
+            var = 1.0 / (y_p + a_w) + 1.0 / (y_n + a_w)
+            scores[w] = delta / math.sqrt(var)
+        return scores
+
+    def top_words(self, polarity, n=50, **kwargs):
+        scores = self.log_odds(**kwargs)
+        sign = 1 if polarity == 'positive' else -1
+        ranked = sorted(((w, z) for w, z in scores.items() if sign * z > 0), key=lambda wz: sign * wz[1], reverse=True)
+        return ranked[:n]
+
+    # ---- persistence ---------------------------------------------------------
+    def to_dict(self):
+        return {
+            'max_terms': self.max_terms,
+            'max_city_terms': self.max_city_terms,
+            'totals': self.totals,
+            'n_posts': self.n_posts,
+            'counts': {p: dict(c) for p, c in self.counts.items()},
+            'city_counts': {city: {p: dict(c) for p, c in cc.items()} for city, cc in self.city_counts.items()},
+            'city_totals': self.city_totals,
+            'counted': list(self.counted),
+        }
+
+    def save(self, path=STATE_FILE):
+        partial = Path(path).with_name(Path(path).name + '.partial')
+        with open(partial, 'w', encoding='utf-8') as f:
+            # json.dumps uses the C encoder; json.dump streams through the pure-Python one
+            f.write(json.dumps(self.to_dict()))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, stop_words, path=STATE_FILE, **kwargs):
+        if not Path(path).exists():
+            return cls(stop_words, **kwargs)
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        tc = cls(stop_words, max_terms=state['max_terms'], max_city_terms=state['max_city_terms'])
+        tc.totals = state['totals']
+        tc.n_posts = state['n_posts']
+        tc.counted = set(state.get('counted', ()))
+        tc.counts = {p: Counter(c) for p, c in state['counts'].items()}
+        tc.city_counts = {city: {p: Counter(c) for p, c in cc.items()} for city, cc in state['city_counts'].items()}
+        # states saved before city totals were tracked: best effort from the (possibly pruned) counts
+        tc.city_totals = state.get('city_totals') or {
+            city: {p: sum(c.values()) for p, c in cc.items()} for city, cc in tc.city_counts.items()
+        }
+        return tc
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank positive / negative emotion words by log-odds')
+    parser.add_argument('--rebuild', action='store_true', help='Recount from emotions.jsonl instead of the saved state')
+    parser.add_argument('--city', default=None, help='Rank words for one city (default: all posts)')
+    parser.add_argument('--top', type=int, default=50, help='Words to print per polarity')
+    parser.add_argument('--min-count', type=int, default=5, dest='min_count', help='Minimum total frequency of a ranked word')
+    parser.add_argument('--max-terms', type=int, default=200_000, dest='max_terms', help='Term cap of each global counter')
+    parser.add_argument('--max-city-terms', type=int, default=20_000, dest='max_city_terms', help='Term cap of each per-city counter')
+    args = parser.parse_args()
+
+    stop_words = load_stop_words()
+    if args.rebuild or not STATE_FILE.exists():
+        counts = TermCounts(stop_words, max_terms=args.max_terms, max_city_terms=args.max_city_terms)
+        counts.update_from_emotions_file()
+        counts.save()
+    else:
+        counts = TermCounts.load(stop_words)
+
+    for polarity in POLARITIES:
+        words = counts.top_words(polarity, n=args.top, city=args.city, min_count=args.min_count)
+        print(f"{polarity.capitalize()} words:", ', '.join(w for w, _ in words))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Local CPU inference server shared by app.py, the notebooks, the emotion
+scripts and the batch jobs.
+
+Hosts the zero-shot + sentiment pipelines (src.classify_sentiment) and the
+emotion classifier once, behind dynamic micro-batchers: individual requests are
+queued and flushed as one model batch when `--max-batch-size` items are
+waiting or the oldest has waited `--max-wait-ms`.
+
+Endpoints (localhost only):
+  POST /classify {"texts": [...], "topk_mean": 3, "threshold": 0.25} -> {"results": [classify_with_sentiment outputs]}
+  POST /emotion  {"texts": [...]}                                     -> {"results": [{emotion: score}]}
+  POST /explain  {"posts": [...], "mode": "keyword"|"word", "budget": 200}  -> top contributing posts explained
+  GET  /stats    queue depth, batch-size histograms, throughput per batcher
+
+Clients: src.inference_client.InferenceClient, or CITYPULSE_BACKEND=remote.
+"""
+import argparse
+import os
+import threading
+from collections import defaultdict
+
+# CPU only: hide GPUs before torch / transformers are imported
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+# this process hosts the models, so it must never forward to itself
+if os.environ.get("CITYPULSE_BACKEND") == "remote":
+    os.environ["CITYPULSE_BACKEND"] = "teacher"
+
+from flask import Flask, jsonify, request
+
+from src.micro_batching import MicroBatcher
+
+EMOTION_MODEL = 'bhadresh-savani/distilbert-base-uncased-emotion'
+EXPLANATION_CACHE = 'results/explanation_cache.jsonl'
+
+app = Flask(__name__)
+batchers = {}
+services = {}
+# zshot / sentiment_clf are shared by the classify batcher thread and /explain
+model_lock = threading.Lock()
+
+
+def build_batchers(max_batch_size, max_wait_ms):
+    import src.classify_sentiment as cs
+    from transformers import pipeline
+
+    emotion_clf = pipeline("text-classification", model=EMOTION_MODEL, top_k=None, device=-1)
+
+    def classify_fn(items):
+        # items: (text, topk_mean, threshold); requests with different options share the flush
+        groups = defaultdict(list)
+        for i, (_, topk_mean, threshold) in enumerate(items):
+            groups[(topk_mean, threshold)].append(i)
+        results = [None] * len(items)
+        for (topk_mean, threshold), idx in groups.items():
+            with model_lock:
+                outs = cs.classify_batch_with_sentiment(
+                    [items[i][0] for i in idx], topk_mean=topk_mean, threshold=threshold, batch_size=max_batch_size
+                )
+            for i, out in zip(idx, outs):
+                results[i] = out
+        return results
+
+    def emotion_fn(texts):
+        outs = emotion_clf(list(texts), batch_size=max_batch_size)
+        return [{item['label']: float(item['score']) for item in out} for out in outs]
+
+    batchers['classify'] = MicroBatcher(classify_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name='classify')
+    batchers['emotion'] = MicroBatcher(emotion_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name='emotion')
+
+    if cs.BACKEND == 'teacher':
+        from src.explanations import ExplanationCache, ExplanationService
+        os.makedirs(os.path.dirname(EXPLANATION_CACHE), exist_ok=True)
+        services['explain'] = ExplanationService(
+            cs.zshot, cs.sentiment_clf, cs.OECD_CATEGORIES, cache=ExplanationCache(EXPLANATION_CACHE), batch_size=max_batch_size
+        )
+
+
+@app.route("/classify", methods=["POST"])
+def classify():
+    body = request.get_json(force=True) or {}
+    texts = body.get("texts") or []
+    topk_mean = body.get("topk_mean")
+    threshold = float(body.get("threshold", 0.25))
+    results = batchers['classify']([(t, topk_mean, threshold) for t in texts])
+    return jsonify({"results": results})
+
+
+@app.route("/emotion", methods=["POST"])
+def emotion():
+    body = request.get_json(force=True) or {}
+    results = batchers['emotion'](body.get("texts") or [])
+    return jsonify({"results": results})
+
+
+@app.route("/explain", methods=["POST"])
+def explain():
+    """
+    Body: {"posts": [text or {"text": ...}], "mode": "keyword", "targets": ["topic", "sentiment"],
+           "budget": 200, "max_posts": null, "topk_mean": 3, "threshold": 0.25}
+    """
+    if 'explain' not in services:
+        return jsonify({"error": "explanations need the teacher backend"}), 503
+    body = request.get_json(force=True) or {}
+    texts = [p.get("text", "") if isinstance(p, dict) else p for p in body.get("posts") or []]
+    texts = [t for t in texts if t]
+    # null means top-1, as for /classify; made explicit so the explainer does not fall back to its default
+    topk_mean = body.get("topk_mean", 3) or 1
+    threshold = float(body.get("threshold", 0.25))
+    outs = batchers['classify']([(t, topk_mean, threshold) for t in texts])
+    with model_lock:
+        result = services['explain'].explain_city(
+            list(zip(texts, outs)),
+            budget=int(body.get("budget", 200)),
+            mode=body.get("mode", "keyword"),
+            targets=tuple(body.get("targets") or ("topic", "sentiment")),
+            max_posts=body.get("max_posts"),
+            topk_mean=topk_mean,
+        )
+    return jsonify(result)
+
+
+@app.route("/stats")
+def stats():
+    return jsonify({name: b.stats() for name, b in batchers.items()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local micro-batching inference server for CityPulse models')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--max-batch-size', type=int, default=32, dest='max_batch_size', help='Flush a batch once this many items are queued')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, dest='max_wait_ms', help='Flush a batch once its oldest item has waited this long')
+    args = parser.parse_args()
+
+    build_batchers(args.max_batch_size, args.max_wait_ms)
+    # threaded so concurrent requests land in the same micro-batch
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
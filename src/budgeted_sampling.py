@@ -0,0 +1,226 @@
+"""
+Budgeted (sampled) CHS estimation for high-volume cities.
+
+Cities such as "Worth" or "Reading" match hundreds or thousands of posts, most
+of which are irrelevant. Instead of classifying every post we:
+  1. split the city's posts into strata (time bucket x cheap keyword prefilter),
+  2. draw a stratified sample up to a budget (or adaptively until the CHS
+     confidence interval is narrow enough),
+  3. estimate topic scores / CHS with stratum weights N_h / n_h,
+  4. report percentile confidence intervals from a vectorized stratified bootstrap.
+"""
+from collections import defaultdict
+import heapq
+import re
+
+import numpy as np
+
+from src.CHS_computation import CHS_WEIGHTS, _sentiment_to_sign
+
+# fixed topic order so topic vectors line up with CHS_WEIGHTS
+TOPIC_ORDER = list(CHS_WEIGHTS.keys())
+_WEIGHT_VEC = np.array([CHS_WEIGHTS[t] for t in TOPIC_ORDER], dtype=float)
+
+
+def build_prefilter(OECD_CATEGORIES):
+    """
+    Return a cheap relevance test: True if the text contains any OECD keyword
+    as a whole word / phrase (\\b boundaries, as in the explanations), no model calls.
+    """
+    terms = sorted({kw.lower() for kws in OECD_CATEGORIES.values() for kw in kws}, key=len, reverse=True)
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in terms) + r")\b", flags=re.IGNORECASE)
+
+    def is_relevant(text: str) -> bool:
+        return pattern.search(text or "") is not None
+
+    return is_relevant
+
+
+def stratify_posts(posts, is_relevant, n_time_buckets=8):
+    """
+    Group post indices by (time_bucket, relevant).
+    Posts without `posted_at_timestamp` go into bucket 0.
+    Returns: dict[(bucket, relevant)] -> list[int]
+    """
+    ts = [p.get("posted_at_timestamp") for p in posts]
+    known = [t for t in ts if t is not None]
+    t_min = min(known) if known else 0
+    t_max = max(known) if known else 0
+    span = max(1, t_max - t_min)
+    n_time_buckets = max(1, int(n_time_buckets))
+
+    strata = defaultdict(list)
+    for i, (p, t) in enumerate(zip(posts, ts)):
+        bucket = 0 if t is None else min(n_time_buckets - 1, int((t - t_min) * n_time_buckets / span))
+        strata[(bucket, bool(is_relevant(p.get("text", ""))))].append(i)
+    return dict(strata)
+
+
+def signed_contributions(outs, topics=TOPIC_ORDER):
+    """
+    Per-post (topic_index, signed_score) following batch_compute_topic_signed_scores:
+    signed = sign(sentiment) * category_score, topic_index = -1 when not counted.
+    """
+    topic_idx = {t: i for i, t in enumerate(topics)}
+    cats = np.full(len(outs), -1, dtype=int)
+    vals = np.zeros(len(outs), dtype=float)
+    for i, out in enumerate(outs):
+        pred_cat = out.get("predicted_category", "none")
+        pred_score = float(out.get("category_score", 0.0))
+        sign = _sentiment_to_sign(out.get("sentiment", {}).get("label", "Neutral"))
+        if pred_cat in topic_idx and pred_score > 0:
+            cats[i] = topic_idx[pred_cat]
+            vals[i] = sign * pred_score
+    return cats, vals
+
+
+def _weighted_topic_means(counts, cats, vals, weights, n_topics):
+    """
+    counts: (B, n) multiplicity of each sampled post in each replicate.
+    Returns (B, n_topics) weighted mean signed score per topic (0 when empty).
+    """
+    onehot = np.zeros((len(cats), n_topics), dtype=float)
+    valid = cats >= 0
+    onehot[np.flatnonzero(valid), cats[valid]] = 1.0
+    num = counts @ (onehot * (weights * vals)[:, None])
+    den = counts @ (onehot * weights[:, None])
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+
+
+def _to_0_10(raw):
+    return (raw + 1.0) / 2.0 * 10.0
+
+
+def estimate_with_ci(cats, vals, weights, strata_ids, n_bootstrap=1000, alpha=0.05, rng=None):
+    """
+    Point estimate + stratified bootstrap CI of topic scores (0-10) and CHS.
+
+    cats, vals, weights, strata_ids: per sampled post arrays of equal length.
+    Resampling is done with replacement within each stratum, all replicates at once.
+    """
+    rng = np.random.default_rng(rng)
+    n = len(cats)
+    n_topics = len(TOPIC_ORDER)
+
+    point_raw = _weighted_topic_means(np.ones((1, n)), cats, vals, weights, n_topics)[0]
+    # topic scores are rounded to 1 decimal like normalize_topic_scores_0_10, for the point and every replicate
+    point_0_10 = {t: float(v) for t, v in zip(TOPIC_ORDER, np.round(_to_0_10(point_raw), 1))}
+    point_chs = sum(CHS_WEIGHTS[t] * point_0_10[t] for t in TOPIC_ORDER)
+
+    # draw bootstrap indices stratum by stratum -> (B, n) index matrix
+    idx = np.empty((n_bootstrap, n), dtype=int)
+    col = 0
+    for sid in np.unique(strata_ids):
+        members = np.flatnonzero(strata_ids == sid)
+        draws = rng.integers(0, len(members), size=(n_bootstrap, len(members)))
+        idx[:, col:col + len(members)] = members[draws]
+        col += len(members)
+
+    # multiplicity matrix via a single bincount over row-offset indices
+    flat = (idx + np.arange(n_bootstrap)[:, None] * n).ravel()
+    counts = np.bincount(flat, minlength=n_bootstrap * n).reshape(n_bootstrap, n).astype(float)
+
+    boot_0_10 = np.round(_to_0_10(_weighted_topic_means(counts, cats, vals, weights, n_topics)), 1)
+    boot_chs = boot_0_10 @ _WEIGHT_VEC
+
+    lo_q, hi_q = 100 * alpha / 2, 100 * (1 - alpha / 2)
+    topic_lo, topic_hi = np.percentile(boot_0_10, [lo_q, hi_q], axis=0)
+    chs_lo, chs_hi = np.percentile(boot_chs, [lo_q, hi_q])
+
+    return {
+        "overall_topic_scores_0_10": point_0_10,
+        "overall_chs": point_chs,
+        "overall_topic_scores_ci": {
+            t: [round(float(l), 2), round(float(h), 2)] for t, l, h in zip(TOPIC_ORDER, topic_lo, topic_hi)
+        },
+        "overall_chs_ci": [float(chs_lo), float(chs_hi)],
+    }
+
+
+def _take(strata, taken, queues, eff_sizes, n_extra):
+    """
+    Sequentially allocate `n_extra` draws to the stratum with the smallest
+    taken/effective-size ratio (proportional, monotone in the total budget).
+    Returns list of newly drawn post indices.
+    """
+    heap = [(taken[k] / eff_sizes[k], k) for k in strata if taken[k] < len(strata[k])]
+    heapq.heapify(heap)
+    new = []
+    while heap and len(new) < n_extra:
+        _, k = heapq.heappop(heap)
+        new.append(queues[k][taken[k]])
+        taken[k] += 1
+        if taken[k] < len(strata[k]):
+            heapq.heappush(heap, (taken[k] / eff_sizes[k], k))
+    return new
+
+
+def budgeted_city_scores(posts, classify_batch, OECD_CATEGORIES, budget=None, target_ci_width=None,
+                         step=64, min_counted=30, n_time_buckets=8, relevant_oversample=2.0,
+                         n_bootstrap=1000, alpha=0.05, seed=0):
+    """
+    Estimate a city's topic scores and CHS from a stratified sample of `posts`.
+
+    - classify_batch(texts) -> list of classify_with_sentiment-shaped dicts
+    - budget: max posts to classify (None = all posts)
+    - target_ci_width: if set, sample `step` posts at a time and stop once the
+      CHS interval is narrower than this (or the budget is exhausted)
+    - min_counted: adaptive mode only stops once this many sampled posts have a
+      topic and a non-neutral sentiment; with fewer, the bootstrap interval can
+      be narrow (even zero-width) just because nothing has been counted yet
+    - relevant_oversample: sampling-rate multiplier for keyword-relevant strata
+      (stratum weights keep the estimate unbiased)
+
+    Returns dict with estimates, CIs, and the sampled posts with their outputs.
+    """
+    rng = np.random.default_rng(seed)
+    is_relevant = build_prefilter(OECD_CATEGORIES)
+    strata = stratify_posts(posts, is_relevant, n_time_buckets=n_time_buckets)
+
+    keys = sorted(strata)
+    queues = {k: [strata[k][j] for j in rng.permutation(len(strata[k]))] for k in keys}
+    eff_sizes = {k: len(strata[k]) * (relevant_oversample if k[1] else 1.0) for k in keys}
+    taken = {k: 0 for k in keys}
+    stratum_of = {i: k for k in keys for i in strata[k]}
+
+    cap = len(posts) if budget is None else min(budget, len(posts))
+    sampled, outs = [], []
+    result = None
+    while len(sampled) < cap:
+        n_extra = cap - len(sampled) if target_ci_width is None else min(step, cap - len(sampled))
+        new = _take(strata, taken, queues, eff_sizes, n_extra)
+        if not new:
+            break
+        outs.extend(classify_batch([posts[i].get("text", "") for i in new]))
+        sampled.extend(new)
+
+        weights = np.array([len(strata[stratum_of[i]]) / taken[stratum_of[i]] for i in sampled], dtype=float)
+        strata_ids = np.array([keys.index(stratum_of[i]) for i in sampled], dtype=int)
+        cats, vals = signed_contributions(outs)
+        result = estimate_with_ci(cats, vals, weights, strata_ids, n_bootstrap=n_bootstrap, alpha=alpha, rng=rng)
+
+        lo, hi = result["overall_chs_ci"]
+        n_counted = int(np.count_nonzero((cats >= 0) & (vals != 0)))
+        if target_ci_width is not None and n_counted >= min_counted and hi - lo <= target_ci_width:
+            break
+
+    if result is None:
+        result = {
+            "overall_topic_scores_0_10": {t: 0.0 for t in TOPIC_ORDER},
+            "overall_chs": 0.0,
+            "overall_topic_scores_ci": {t: [0.0, 0.0] for t in TOPIC_ORDER},
+            "overall_chs_ci": [0.0, 0.0],
+        }
+    result["n_sampled_posts"] = len(sampled)
+    result["sampled_posts"] = [posts[i] for i in sampled]
+    result["sampled_outputs"] = outs
+    return result
+
+
+__all__ = [
+    "build_prefilter",
+    "stratify_posts",
+    "signed_contributions",
+    "estimate_with_ci",
+    "budgeted_city_scores",
+]
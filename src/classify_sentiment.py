@@ -1,6 +1,10 @@
+import os
+
 from transformers import pipeline
 import numpy as np
 
+from src import metrics
+
 # ==== OECD WELL-BEING TOPICS (exact names) ===================================
 
 access_to_services_keywords = [
@@ -95,11 +99,39 @@ OECD_CATEGORIES = {
 
 
 # 2) Models -------------------------------------------------------------------
-# Zero-shot for relevance 
-zshot = pipeline("zero-shot-classification", model="roberta-large-mnli", device_map="auto")
-
-# Sentiment (optional, for CHS sub-scores)
-sentiment_clf = pipeline("sentiment-analysis", model="cardiffnlp/twitter-roberta-base-sentiment-latest", device_map="auto")
+# Backend: "teacher" (zero-shot + sentiment pipelines), "student" (distilled
+# single-pass model trained by distill_student.py, see src/student_model.py)
+# or "remote" (shared micro-batching server, see inference_server.py)
+BACKEND = os.environ.get("CITYPULSE_BACKEND", "teacher")
+STUDENT_PATH = os.environ.get("CITYPULSE_STUDENT_PATH", "models/citypulse_student")
+
+if BACKEND == "teacher":
+	# Zero-shot for relevance 
+	zshot = pipeline("zero-shot-classification", model="roberta-large-mnli", device_map="auto")
+
+	# Sentiment (optional, for CHS sub-scores)
+	sentiment_clf = pipeline("sentiment-analysis", model="cardiffnlp/twitter-roberta-base-sentiment-latest", device_map="auto")
+elif BACKEND in ("student", "remote"):
+	# teacher pipelines are not loaded; the student / inference client is created on first use
+	zshot = None
+	sentiment_clf = None
+else:
+	raise ValueError(f"Unknown CITYPULSE_BACKEND: {BACKEND!r} (expected 'teacher', 'student' or 'remote')")
+
+_student = None
+
+def get_student():
+	"""Lazily load the distilled student from STUDENT_PATH."""
+	global _student
+	if _student is None:
+		from src.student_model import StudentClassifier
+		_student = StudentClassifier(STUDENT_PATH)
+	return _student
+
+def get_client():
+	"""Client for the shared local inference server (inference_server.py)."""
+	from src.inference_client import default_client
+	return default_client()
 
 
 # 3) Category scoring helpers -------------------------------------------------
@@ -132,7 +164,8 @@ def classify_citypulse_topic(text: str, topk_mean: int | None = None, threshold:
 	"""
 	cat_results = {}
 	for cat, labels in OECD_CATEGORIES.items():
-		r = score_category(text, labels, topk_mean=topk_mean)
+		with metrics.timer("zshot", category=cat):
+			r = score_category(text, labels, topk_mean=topk_mean)
 		cat_results[cat] = r
 
 	# pick best category
@@ -149,17 +182,72 @@ def classify_citypulse_topic(text: str, topk_mean: int | None = None, threshold:
 	}
 
 def classify_with_sentiment(text: str, **kwargs):
+	if BACKEND == "student":
+		return get_student().classify(text, **kwargs)
+	if BACKEND == "remote":
+		return get_client().classify_with_sentiment(text, **kwargs)
 	topic = classify_citypulse_topic(text, **kwargs)
-	sent = sentiment_clf(text)[0]  # {'label': 'Positive'|'Negative'|'Neutral', 'score': p}
+	with metrics.timer("sentiment_clf"):
+		sent = sentiment_clf(text)[0]  # {'label': 'Positive'|'Negative'|'Neutral', 'score': p}
 	topic["sentiment"] = sent
+	metrics.inc("posts_classified")
 	return topic
 
+def classify_batch_with_sentiment(texts, topk_mean: int | None = None, threshold: float = 0.25, batch_size: int = 32):
+	"""
+	Batched classify_with_sentiment: one zshot call per category per chunk of
+	`batch_size` texts and one batched sentiment call. Same output per text.
+	"""
+	texts = list(texts)
+	if BACKEND == "student":
+		return get_student().classify_batch(texts, topk_mean=topk_mean, threshold=threshold, batch_size=batch_size)
+	if BACKEND == "remote":
+		return get_client().classify_batch_with_sentiment(texts, topk_mean=topk_mean, threshold=threshold)
+
+	cat_results = {cat: [] for cat in OECD_CATEGORIES}
+	for cat, labels in OECD_CATEGORIES.items():
+		for start in range(0, len(texts), batch_size):
+			with metrics.timer("zshot", category=cat):
+				outs = zshot(texts[start:start + batch_size], candidate_labels=labels, multi_label=True, batch_size=batch_size)
+			if isinstance(outs, dict):
+				outs = [outs]
+			for out in outs:
+				label_scores = sorted(zip(out["labels"], out["scores"]), key=lambda x: x[1], reverse=True)
+				if topk_mean and topk_mean > 1:
+					agg = float(np.mean([sc for _, sc in label_scores[:min(topk_mean, len(label_scores))]]))
+				else:
+					agg = float(label_scores[0][1])
+				cat_results[cat].append({"score": agg, "best_label": label_scores[0][0], "label_scores": label_scores})
+
+	sents = []
+	for start in range(0, len(texts), batch_size):
+		with metrics.timer("sentiment_clf"):
+			sents.extend(sentiment_clf(texts[start:start + batch_size], batch_size=batch_size))
+	metrics.inc("posts_classified", len(texts))
+
+	outputs = []
+	for i in range(len(texts)):
+		cat_name, cat_info = max(((cat, res[i]) for cat, res in cat_results.items()), key=lambda kv: kv[1]["score"])
+		outputs.append({
+			"predicted_category": cat_name if cat_info["score"] >= threshold else "none",
+			"category_score": cat_info["score"],
+			"top_keyword": cat_info["best_label"],
+			"all_category_scores": {cat: res[i]["score"] for cat, res in cat_results.items()},
+			"explanation_top3_keywords": cat_info["label_scores"][:3],
+			"sentiment": sents[i],
+		})
+	return outputs
+
 
 __all__ = [
 	"OECD_CATEGORIES",
 	"score_category",
 	"classify_citypulse_topic",
 	"classify_with_sentiment",
+	"classify_batch_with_sentiment",
 	"zshot",
 	"sentiment_clf",
+	"BACKEND",
+	"get_student",
+	"get_client",
 ]
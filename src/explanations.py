@@ -0,0 +1,233 @@
+"""
+Budgeted, batched explanations for the production classifiers (OECD topic via
+`zshot`, sentiment via `sentiment_clf`).
+
+Attributions are occlusion deltas: score(original) - score(text with feature removed).
+  mode="keyword" : features are the OECD_CATEGORIES terms found in the post (cheap,
+                   usually a handful of evaluations per post)
+  mode="word"    : features are the post's words, capped at `max_features`
+
+Masked inputs from all posts in a request are evaluated together (one zshot call
+per category, one sentiment call), results are cached by text hash, and
+`explain_city` spends a per-request evaluation budget on the posts contributing
+most to the city's score.
+"""
+from collections import defaultdict
+from pathlib import Path
+import hashlib
+import json
+import re
+
+import numpy as np
+
+from src import metrics
+from src.CHS_computation import _sentiment_to_sign
+
+WORD_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+
+
+def explanation_key(text, mode, target, explained, topk_mean=None):
+    """Cache key; `explained` is the category / sentiment label, `topk_mean` only matters for topics."""
+    if target != "topic":
+        topk_mean = None
+    return hashlib.sha1(f"{mode}|{target}|{explained}|{topk_mean}|{text}".encode("utf-8")).hexdigest()
+
+
+class ExplanationCache:
+    """In-memory cache, optionally persisted as append-only JSONL."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._data = {}
+        if self.path and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._data[row["key"]] = row["explanation"]
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def put(self, key, explanation):
+        self._data[key] = explanation
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "explanation": explanation}, ensure_ascii=False) + "\n")
+
+
+class ExplanationService:
+    def __init__(self, zshot, sentiment_clf, OECD_CATEGORIES, cache=None, topk_mean=3, batch_size=32, max_features=30):
+        self.zshot = zshot
+        self.sentiment_clf = sentiment_clf
+        self.categories = OECD_CATEGORIES
+        self.cache = cache if cache is not None else ExplanationCache()
+        self.topk_mean = topk_mean
+        self.batch_size = batch_size
+        self.max_features = max_features
+        terms = sorted({kw for kws in OECD_CATEGORIES.values() for kw in kws}, key=len, reverse=True)
+        self._term_res = [(kw, re.compile(r"\b" + re.escape(kw) + r"\b", flags=re.IGNORECASE)) for kw in terms]
+
+    # ---- features / masks ----------------------------------------------------
+    def features(self, text, mode):
+        """Return list of (feature, masked_text)."""
+        if mode == "keyword":
+            feats = [(kw, pat) for kw, pat in self._term_res if pat.search(text)]
+        elif mode == "word":
+            words = list(dict.fromkeys(WORD_RE.findall(text)))[:self.max_features]
+            feats = [(w, re.compile(r"\b" + re.escape(w) + r"\b")) for w in words]
+        else:
+            raise ValueError(f"Unknown explanation mode: {mode!r} (expected 'keyword' or 'word')")
+        return [(f, re.sub(r"\s+", " ", pat.sub(" ", text)).strip()) for f, pat in feats]
+
+    def explained(self, out, target):
+        """What a target explains for one classification: its OECD category or sentiment label."""
+        if target == "topic":
+            cat = out.get("predicted_category", "none")
+            if cat not in self.categories:
+                scores = out.get("all_category_scores") or {}
+                cat = max(scores, key=scores.get) if scores else next(iter(self.categories))
+            return cat
+        if target == "sentiment":
+            return out.get("sentiment", {}).get("label", "neutral")
+        raise ValueError(f"Unknown explanation target: {target!r}")
+
+    def cost(self, item, mode, targets, topk_mean=None):
+        """Model evaluations needed to explain `item` = (text, output) (0 when fully cached)."""
+        text, out = item
+        topk_mean = self.topk_mean if topk_mean is None else topk_mean
+        missing = [t for t in targets if explanation_key(text, mode, t, self.explained(out, t), topk_mean) not in self.cache]
+        return (len(self.features(text, mode)) + 1) * len(missing) if missing else 0
+
+    # ---- batched scoring -----------------------------------------------------
+    def _topic_scores(self, requests, topk_mean):
+        """requests: list of (category, text) -> list of aggregated category scores."""
+        by_cat = defaultdict(list)
+        for i, (cat, text) in enumerate(requests):
+            by_cat[cat].append(i)
+        scores = [0.0] * len(requests)
+        for cat, idx in by_cat.items():
+            texts = [requests[i][1] for i in idx]
+            for start in range(0, len(texts), self.batch_size):
+                outs = self.zshot(texts[start:start + self.batch_size], candidate_labels=self.categories[cat], multi_label=True, batch_size=self.batch_size)
+                if isinstance(outs, dict):
+                    outs = [outs]
+                for j, out in zip(idx[start:start + self.batch_size], outs):
+                    vals = sorted(out["scores"], reverse=True)
+                    k = min(topk_mean, len(vals)) if topk_mean and topk_mean > 1 else 1
+                    scores[j] = float(np.mean(vals[:k]))
+        return scores
+
+    def _sentiment_scores(self, requests):
+        """requests: list of (label, text) -> probability of `label` for each text."""
+        texts = [t for _, t in requests]
+        dists = []
+        for start in range(0, len(texts), self.batch_size):
+            dists.extend(self.sentiment_clf(texts[start:start + self.batch_size], top_k=None, batch_size=self.batch_size))
+        return [
+            float(next((d["score"] for d in dist if d["label"].lower() == label.lower()), 0.0))
+            for (label, _), dist in zip(requests, dists)
+        ]
+
+    # ---- public API ----------------------------------------------------------
+    def explain_batch(self, items, mode="keyword", targets=("topic", "sentiment"), topk_mean=None):
+        """
+        items: list of (text, classify_with_sentiment output).
+        topk_mean: category score aggregation, as used for the classification (default: the service's).
+        Returns one dict per item: {target: {"explained": ..., "base_score": ..., "attributions": [(feature, delta)]}}
+        """
+        topk_mean = self.topk_mean if topk_mean is None else topk_mean
+        plan = []  # (item_idx, target, what, feats, first_request_idx)
+        topic_reqs, sent_reqs = [], []
+        results = [{} for _ in items]
+
+        for i, (text, out) in enumerate(items):
+            feats = None
+            for target in targets:
+                what = self.explained(out, target)
+                cached = self.cache.get(explanation_key(text, mode, target, what, topk_mean))
+                if cached is not None:
+                    metrics.inc("posts_cached", cache="explanation")
+                    results[i][target] = cached
+                    continue
+                if feats is None:
+                    feats = self.features(text, mode)
+                variants = [text] + [m for _, m in feats]
+                if target == "topic":
+                    plan.append((i, target, what, feats, len(topic_reqs)))
+                    topic_reqs.extend((what, v) for v in variants)
+                else:
+                    plan.append((i, target, what, feats, len(sent_reqs)))
+                    sent_reqs.extend((what, v) for v in variants)
+
+        topic_scores = self._topic_scores(topic_reqs, topk_mean) if topic_reqs else []
+        sent_scores = self._sentiment_scores(sent_reqs) if sent_reqs else []
+
+        for i, target, what, feats, first in plan:
+            scores = topic_scores if target == "topic" else sent_scores
+            base = scores[first]
+            attributions = [(f, base - scores[first + 1 + j]) for j, (f, _) in enumerate(feats)]
+            attributions.sort(key=lambda fa: abs(fa[1]), reverse=True)
+            explanation = {"explained": what, "base_score": base, "mode": mode, "n_evals": len(feats) + 1, "attributions": attributions}
+            if target == "topic":
+                explanation["topk_mean"] = topk_mean
+            self.cache.put(explanation_key(items[i][0], mode, target, what, topk_mean), explanation)
+            results[i][target] = explanation
+        return results
+
+    def explain_city(self, items, budget=200, mode="keyword", targets=("topic", "sentiment"), max_posts=None, topk_mean=None):
+        """
+        Explain a city's top contributing posts within `budget` model evaluations.
+        Contribution = |sentiment sign * category_score| as in the batch CHS pipeline.
+        Cached posts cost nothing; posts that would exceed the budget are skipped.
+        """
+        def contribution(out):
+            if out.get("predicted_category", "none") not in self.categories:
+                return 0.0
+            sign = _sentiment_to_sign(out.get("sentiment", {}).get("label", "Neutral"))
+            return abs(sign * float(out.get("category_score", 0.0)))
+
+        ranked = sorted(range(len(items)), key=lambda i: contribution(items[i][1]), reverse=True)
+        chosen, spent = [], 0
+        for i in ranked:
+            if max_posts is not None and len(chosen) >= max_posts:
+                break
+            c = self.cost(items[i], mode, targets, topk_mean=topk_mean)
+            if spent + c > budget:
+                continue
+            chosen.append(i)
+            spent += c
+
+        explanations = self.explain_batch([items[i] for i in chosen], mode=mode, targets=targets, topk_mean=topk_mean)
+
+        # city-level summary: summed attribution per feature
+        summary = {t: defaultdict(float) for t in targets}
+        for exp in explanations:
+            for t in targets:
+                for f, delta in exp[t]["attributions"]:
+                    summary[t][f] += delta
+        return {
+            "n_posts": len(items),
+            "n_explained": len(chosen),
+            "evals_used": spent,
+            "budget": budget,
+            "posts": [
+                {"text": items[i][0], "contribution": contribution(items[i][1]), **exp}
+                for i, exp in zip(chosen, explanations)
+            ],
+            "top_features": {
+                t: sorted(s.items(), key=lambda fa: abs(fa[1]), reverse=True)[:20] for t, s in summary.items()
+            },
+        }
+
+
+__all__ = [
+    "ExplanationCache",
+    "ExplanationService",
+    "explanation_key",
+]
@@ -0,0 +1,68 @@
+"""
+Thin client for the local inference server (inference_server.py).
+
+Implements the same `classify_with_sentiment` interface as
+src.classify_sentiment, so callers can switch to the shared server without
+loading any model in-process (or set CITYPULSE_BACKEND=remote).
+"""
+import json
+import os
+import urllib.request
+
+DEFAULT_URL = os.environ.get("CITYPULSE_INFERENCE_URL", "http://127.0.0.1:5002")
+
+
+class InferenceClient:
+    def __init__(self, base_url=DEFAULT_URL, timeout=300.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        req = urllib.request.Request(
+            self.base_url + path, data=data,
+            headers={"Content-Type": "application/json"},
+            method="GET" if data is None else "POST",
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def classify_batch_with_sentiment(self, texts, topk_mean=None, threshold=0.25):
+        return self._request("/classify", {"texts": list(texts), "topk_mean": topk_mean, "threshold": threshold})["results"]
+
+    def classify_with_sentiment(self, text, topk_mean=None, threshold=0.25):
+        return self.classify_batch_with_sentiment([text], topk_mean=topk_mean, threshold=threshold)[0]
+
+    def emotions(self, texts):
+        """Per text: dict[emotion] -> score."""
+        return self._request("/emotion", {"texts": list(texts)})["results"]
+
+    def explain(self, posts, mode="keyword", targets=("topic", "sentiment"), budget=200, max_posts=None, topk_mean=3, threshold=0.25):
+        """Explain a city's top contributing posts within `budget` model evaluations."""
+        return self._request("/explain", {
+            "posts": list(posts), "mode": mode, "targets": list(targets), "budget": budget, "max_posts": max_posts,
+            "topk_mean": topk_mean, "threshold": threshold,
+        })
+
+    def stats(self):
+        return self._request("/stats")
+
+
+_default = None
+
+def default_client():
+    global _default
+    if _default is None:
+        _default = InferenceClient()
+    return _default
+
+
+def classify_with_sentiment(text: str, **kwargs):
+    return default_client().classify_with_sentiment(text, **kwargs)
+
+
+__all__ = [
+    "InferenceClient",
+    "default_client",
+    "classify_with_sentiment",
+]
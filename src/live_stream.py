@@ -0,0 +1,148 @@
+"""
+Server-sent events fan-out of live city scores.
+
+The ingestion worker calls `DeltaBroadcaster.publish(rows)` once per snapshot.
+Only cities whose post count or coordinates changed, or whose score moved by
+more than `score_epsilon` since it was last broadcast, go into a numbered delta
+kept in a short in-memory log. Each client stream starts with a compact full
+snapshot and then sends the merged deltas since its last sequence number, at
+most once every `min_interval` seconds. Publishing never waits on clients,
+a slow client just gets a bigger coalesced delta (or a fresh snapshot once it
+falls off the log), and per-client work scales with the number of changed
+cities rather than the number of cities.
+
+Events:
+  snapshot  {"seq": n, "cities": {city: {"score", "posts", "lat", "lng"}}}
+  delta     {"seq": n, "changed": {city: {...}}, "removed": [city, ...]}
+"""
+from collections import deque
+import json
+import threading
+import time
+
+from src import metrics
+
+
+def _compact(row, digits):
+    return {"score": round(float(row["score"]), digits), "posts": len(row["posts"]), "lat": float(row["lat"]), "lng": float(row["lng"])}
+
+
+def format_event(event, data, seq=None):
+    """One SSE frame."""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'), ensure_ascii=False)}\n\n"
+
+
+class DeltaBroadcaster:
+    def __init__(self, score_epsilon=0.05, log_size=256, digits=4):
+        self.score_epsilon = score_epsilon
+        self.digits = digits
+        self._cond = threading.Condition()
+        self._log = deque(maxlen=log_size)  # (seq, changed, removed)
+        self._seq = 0
+        self._state = {}  # city -> compact row as last broadcast
+        self.n_clients = 0
+
+    def publish(self, rows):
+        """rows: app snapshot rows (city, score, posts, lat, lng). Returns the new sequence number."""
+        changed, seen = {}, set()
+        for row in rows:
+            city = row["city"]
+            seen.add(city)
+            new = _compact(row, self.digits)
+            old = self._state.get(city)
+            if (old is None or old["posts"] != new["posts"] or old["lat"] != new["lat"] or old["lng"] != new["lng"]
+                    or abs(old["score"] - new["score"]) > self.score_epsilon):
+                changed[city] = new
+        removed = [city for city in self._state if city not in seen]
+        if not changed and not removed:
+            return self._seq
+        with self._cond:
+            self._state.update(changed)
+            for city in removed:
+                del self._state[city]
+            self._seq += 1
+            self._log.append((self._seq, changed, removed))
+            self._cond.notify_all()
+        metrics.inc("stream_deltas")
+        metrics.inc("stream_cities_changed", len(changed) + len(removed))
+        return self._seq
+
+    def snapshot(self):
+        with self._cond:
+            return self._seq, dict(self._state)
+
+    def since(self, seq):
+        """
+        Coalesced changes after `seq`: (current_seq, changed, removed), or
+        (current_seq, None, None) if `seq` is no longer covered by the log.
+        """
+        with self._cond:
+            current = self._seq
+            if seq == current:
+                return current, {}, []
+            if seq > current or not self._log or self._log[0][0] > seq + 1:
+                return current, None, None
+            entries = [e for e in self._log if e[0] > seq]
+        changed, removed = {}, set()
+        for _, ch, rm in entries:
+            for city in rm:
+                changed.pop(city, None)
+                removed.add(city)
+            for city, row in ch.items():
+                removed.discard(city)
+                changed[city] = row
+        return current, changed, sorted(removed)
+
+    def wait(self, seq, timeout):
+        """Block until something newer than `seq` is published; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq != seq, timeout)
+
+    def stream(self, last_seq=None, min_interval=1.0, keepalive=15.0):
+        """
+        Generator of SSE frames for one client. `last_seq` (from Last-Event-ID)
+        resumes with a delta instead of a snapshot when still in the log.
+        """
+        with self._cond:
+            self.n_clients += 1
+        metrics.inc("stream_connections")
+        try:
+            seq = None
+            if last_seq is not None:
+                current, changed, removed = self.since(last_seq)
+                if changed is not None:
+                    seq = current
+                    if changed or removed:
+                        yield format_event("delta", {"seq": current, "changed": changed, "removed": removed}, current)
+            if seq is None:
+                seq, state = self.snapshot()
+                yield format_event("snapshot", {"seq": seq, "cities": state}, seq)
+            last_sent = time.monotonic()
+            while True:
+                if not self.wait(seq, keepalive):
+                    yield ": keepalive\n\n"
+                    continue
+                # rate limit: let further deltas coalesce into this one
+                delay = min_interval - (time.monotonic() - last_sent)
+                if delay > 0:
+                    time.sleep(delay)
+                current, changed, removed = self.since(seq)
+                if changed is None:
+                    current, state = self.snapshot()
+                    frame = format_event("snapshot", {"seq": current, "cities": state}, current)
+                else:
+                    frame = format_event("delta", {"seq": current, "changed": changed, "removed": removed}, current)
+                seq = current
+                last_sent = time.monotonic()
+                metrics.inc("stream_bytes", len(frame))
+                yield frame
+        finally:
+            with self._cond:
+                self.n_clients -= 1
+
+
+__all__ = [
+    "DeltaBroadcaster",
+    "format_event",
+]
@@ -0,0 +1,196 @@
+"""
+Lightweight in-process instrumentation: counters, per-stage timing histograms
+and optional sampled cProfile, cheap enough to leave on in production.
+
+    from src import metrics
+    with metrics.timer("zshot", category=cat): ...
+    @metrics.timed_fn("aggregation")
+    metrics.inc("posts_classified", len(texts))
+    metrics.render_prometheus()         # text for a /metrics endpoint
+    metrics.write_profile_summary(path) # per-run JSON summary for batch scripts
+
+Sampled profiling is opt-in: CITYPULSE_CPROFILE=<rate in [0,1]> profiles that
+fraction of `metrics.profiled(...)` blocks and aggregates their stats.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILE_RATE = float(os.environ.get("CITYPULSE_CPROFILE", "0") or 0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> float
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_started = time.time()
+
+_profile_stats = None
+_profile_samples = 0
+_profile_active = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(stage, seconds, **labels):
+    k = _key(stage, labels)
+    i = bisect_left(BUCKETS, seconds)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [0] * (len(BUCKETS) + 2)
+        h[i] += 1
+        h[-1] += seconds
+
+
+@contextmanager
+def timer(stage, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, **labels)
+
+
+def timed_fn(stage, **labels):
+    """Decorator form of `timer`."""
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with timer(stage, **labels):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+@contextmanager
+def profiled(name="run"):
+    """
+    Profile this block with cProfile for a PROFILE_RATE fraction of calls.
+    Only one block is profiled at a time; others run unprofiled.
+    """
+    global _profile_stats, _profile_samples
+    if PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE or not _profile_active.acquire(blocking=False):
+        yield
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+        with _lock:
+            if _profile_stats is None:
+                _profile_stats = pstats.Stats(prof)
+            else:
+                _profile_stats.add(prof)
+            _profile_samples += 1
+        inc("profile_samples", block=name)
+    finally:
+        _profile_active.release()
+
+
+def reset():
+    global _profile_stats, _profile_samples, _started
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _profile_stats = None
+        _profile_samples = 0
+        _started = time.time()
+
+
+# ---- exporters ---------------------------------------------------------------
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus(prefix="citypulse"):
+    """Prometheus text exposition format (v0.0.4)."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f"{prefix}_{name}_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_fmt_labels(labels)} {value}")
+
+    for (stage, labels), h in histograms:
+        metric = f"{prefix}_stage_seconds"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} histogram")
+            seen.add(metric)
+        stage_labels = (("stage", stage),) + labels
+        cumulative = 0
+        for upper, n in zip(BUCKETS, h):
+            cumulative += n
+            lines.append(f"{metric}_bucket{_fmt_labels(stage_labels, [('le', upper)])} {cumulative}")
+        cumulative += h[len(BUCKETS)]
+        lines.append(f"{metric}_bucket{_fmt_labels(stage_labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{metric}_sum{_fmt_labels(stage_labels)} {h[-1]}")
+        lines.append(f"{metric}_count{_fmt_labels(stage_labels)} {cumulative}")
+
+    lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+    lines.append(f"{prefix}_uptime_seconds {time.time() - _started}")
+    return "\n".join(lines) + "\n"
+
+
+def summary(top_functions=25):
+    """Dict of counters, per-stage count/total/mean seconds and (if sampled) top cProfile entries."""
+    with _lock:
+        counters = {f"{n}{_fmt_labels(l)}": v for (n, l), v in sorted(_counters.items())}
+        stages = {}
+        for (n, l), h in sorted(_histograms.items()):
+            count = sum(h[:-1])
+            stages[f"{n}{_fmt_labels(l)}"] = {"count": count, "total_seconds": h[-1], "mean_seconds": h[-1] / count if count else 0.0}
+        out = {"wall_seconds": time.time() - _started, "counters": counters, "stages": stages}
+        if _profile_stats is not None:
+            buf = io.StringIO()
+            _profile_stats.stream = buf
+            _profile_stats.sort_stats("cumulative").print_stats(top_functions)
+            out["profile"] = {"samples": _profile_samples, "rate": PROFILE_RATE, "top_cumulative": buf.getvalue()}
+    return out
+
+
+def write_profile_summary(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary(), f, indent=2)
+
+
+__all__ = [
+    "inc",
+    "observe",
+    "timer",
+    "timed_fn",
+    "profiled",
+    "reset",
+    "render_prometheus",
+    "summary",
+    "write_profile_summary",
+]
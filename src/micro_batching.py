@@ -0,0 +1,138 @@
+"""
+Dynamic micro-batching for model calls.
+
+Callers submit single items and get a Future back. A worker thread collects
+queued items and flushes them as one batch when either `max_batch_size` items
+are waiting or the oldest item has waited `max_wait_ms`.
+"""
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+# upper bounds of the batch-size histogram buckets (last bucket is open-ended)
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=10.0, name="batcher"):
+        """
+        batch_fn(list_of_items) -> list_of_results (same length and order)
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._hist = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._n_items = 0
+        self._n_batches = 0
+        self._n_errors = 0
+        self._max_queue_depth = 0
+        self._wait_total = 0.0
+        self._busy_total = 0.0
+
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f"micro-batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return fut
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    def __call__(self, items, timeout=None):
+        """Submit `items` and block until all results are ready."""
+        return [f.result(timeout=timeout) for f in self.submit_many(items)]
+
+    def close(self):
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                nxt = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                self._stopped = True
+                break
+            batch.append(nxt)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect()
+            if not batch:
+                break
+            items = [b[0] for b in batch]
+            futures = [b[1] for b in batch]
+            t0 = time.perf_counter()
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+                for fut, res in zip(futures, results):
+                    fut.set_result(res)
+            except Exception as e:
+                with self._stats_lock:
+                    self._n_errors += 1
+                for fut in futures:
+                    if not fut.done():
+                        fut.set_exception(e)
+            t1 = time.perf_counter()
+            with self._stats_lock:
+                self._n_batches += 1
+                self._n_items += len(batch)
+                self._wait_total += sum(t0 - b[2] for b in batch)
+                self._busy_total += t1 - t0
+                self._hist[self._bucket(len(batch))] += 1
+
+    @staticmethod
+    def _bucket(size):
+        for i, upper in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= upper:
+                return i
+        return len(BATCH_SIZE_BUCKETS)
+
+    def stats(self):
+        with self._stats_lock:
+            labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "items": self._n_items,
+                "batches": self._n_batches,
+                "errors": self._n_errors,
+                "mean_batch_size": self._n_items / self._n_batches if self._n_batches else 0.0,
+                "mean_queue_wait_ms": 1000.0 * self._wait_total / self._n_items if self._n_items else 0.0,
+                "busy_seconds": self._busy_total,
+                "batch_size_histogram": dict(zip(labels, self._hist)),
+            }
+
+
+__all__ = [
+    "BATCH_SIZE_BUCKETS",
+    "MicroBatcher",
+]
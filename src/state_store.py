@@ -0,0 +1,113 @@
+"""
+Durable checkpoint of the live app state, in SQLite (WAL mode).
+
+A checkpoint holds the windowed posts per city, the time-series bins of the
+cities touched since the previous checkpoint, and the ingest position in the
+mentions file (byte offset, line count, fingerprint of the file head). On
+restart the app loads the latest checkpoint and only replays input after the
+offset, so startup cost depends on the window size, not on the size of
+city_mentions.jsonl.
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+
+from src import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS posts (city TEXT NOT NULL, posted_at INTEGER NOT NULL, text TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS posts_city ON posts (city);
+CREATE TABLE IF NOT EXISTS history (city TEXT PRIMARY KEY, data BLOB NOT NULL);
+"""
+
+# bytes of the input file hashed to detect it being replaced or truncated
+FINGERPRINT_BYTES = 4096
+
+
+def file_fingerprint(path, offset):
+    """sha1 of the first min(offset, FINGERPRINT_BYTES) bytes of `path`."""
+    n = min(int(offset), FINGERPRINT_BYTES)
+    with open(path, "rb") as f:
+        head = f.read(n)
+    if len(head) < n:
+        return None
+    return hashlib.sha1(head).hexdigest()
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit mode; checkpoints use explicit transactions
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def checkpoint(self, meta, counts, history_blobs=None):
+        """
+        Replace the stored state in one transaction.
+        meta: JSON-serialisable dict (ingest offset etc.)
+        counts: app.counts ({city: {"posts": [{"posted_at_timestamp", "text"}]}})
+        history_blobs: {city: bytes} for cities whose history changed
+        """
+        rows = [(city, post["posted_at_timestamp"], post["text"]) for city, stuff in counts.items() for post in stuff["posts"]]
+        with metrics.timer("checkpoint_write"):
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute("DELETE FROM posts")
+                cur.executemany("INSERT INTO posts (city, posted_at, text) VALUES (?, ?, ?)", rows)
+                cur.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(k, json.dumps(v)) for k, v in meta.items()])
+                if history_blobs:
+                    cur.executemany("INSERT OR REPLACE INTO history (city, data) VALUES (?, ?)", list(history_blobs.items()))
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+        metrics.inc("checkpoints")
+
+    def load(self):
+        """Latest checkpoint as {"meta", "counts", "history"}, or None if nothing is stored."""
+        meta = {k: json.loads(v) for k, v in self._conn.execute("SELECT key, value FROM meta")}
+        if not meta:
+            return None
+        counts = {}
+        for city, posted_at, text in self._conn.execute("SELECT city, posted_at, text FROM posts ORDER BY rowid"):
+            counts.setdefault(city, {"posts": []})["posts"].append({"posted_at_timestamp": posted_at, "text": text})
+        history = dict(self._conn.execute("SELECT city, data FROM history"))
+        return {"meta": meta, "counts": counts, "history": history}
+
+    def clear(self):
+        """Drop the stored state, e.g. once it no longer matches the input."""
+        cur = self._conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("DELETE FROM posts")
+            cur.execute("DELETE FROM history")
+            cur.execute("DELETE FROM meta")
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+
+    def matches_input(self, meta, mentions_file):
+        """True if the checkpoint's offset is still valid for `mentions_file`."""
+        if meta.get("mentions_file") != os.path.abspath(mentions_file) or not os.path.exists(mentions_file):
+            return False
+        offset = meta.get("ingest_offset", 0)
+        if os.path.getsize(mentions_file) < offset:
+            return False
+        return file_fingerprint(mentions_file, offset) == meta.get("fingerprint")
+
+    def close(self):
+        self._conn.close()
+
+
+__all__ = [
+    "StateStore",
+    "file_fingerprint",
+]
@@ -0,0 +1,141 @@
+"""
+Compact multi-head student distilled from the CityPulse teacher pipelines.
+
+One shared small encoder, three heads, one forward pass per post:
+  - topic head     : 11 OECD category scores (regresses the teacher's top-k mean zero-shot score)
+  - sentiment head : 3-way sentiment (negative / neutral / positive)
+  - keyword head   : per (category, keyword) zero-shot score, used only to fill
+                     `top_keyword` / `explanation_top3_keywords` in the output
+
+`StudentClassifier.classify` returns the same shape as `classify_with_sentiment`.
+Trained by `distill_student.py`.
+"""
+from pathlib import Path
+import json
+
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModel, AutoTokenizer
+
+DEFAULT_ENCODER = "google/bert_uncased_L-4_H-256_A-4"
+SENTIMENT_LABELS = ["negative", "neutral", "positive"]
+# subdirectory of a saved student holding the encoder's transformers config
+ENCODER_SUBDIR = "encoder"
+
+
+def keyword_index(OECD_CATEGORIES):
+    """Flat list of (category, keyword) pairs; keywords repeated across categories stay separate."""
+    return [(cat, kw) for cat, kws in OECD_CATEGORIES.items() for kw in kws]
+
+
+class CityPulseStudent(nn.Module):
+    def __init__(self, encoder_name, categories, n_keywords, dropout=0.1, encoder_config=None):
+        super().__init__()
+        # with a saved config only the architecture is built; the weights come from student.pt
+        if encoder_config is not None:
+            self.encoder = AutoModel.from_config(encoder_config)
+        else:
+            self.encoder = AutoModel.from_pretrained(encoder_name)
+        hidden = self.encoder.config.hidden_size
+        self.dropout = nn.Dropout(dropout)
+        self.topic_head = nn.Linear(hidden, len(categories))
+        self.sentiment_head = nn.Linear(hidden, len(SENTIMENT_LABELS))
+        self.keyword_head = nn.Linear(hidden, n_keywords)
+
+    def forward(self, input_ids, attention_mask):
+        out = self.encoder(input_ids=input_ids, attention_mask=attention_mask)
+        # mean-pool token states (masked)
+        mask = attention_mask.unsqueeze(-1).type_as(out.last_hidden_state)
+        pooled = (out.last_hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1.0)
+        pooled = self.dropout(pooled)
+        return {
+            "topic_logits": self.topic_head(pooled),
+            "sentiment_logits": self.sentiment_head(pooled),
+            "keyword_logits": self.keyword_head(pooled),
+        }
+
+
+class StudentClassifier:
+    """
+    Inference wrapper around a saved student directory:
+      config.json, student.pt, tokenizer files, encoder/config.json
+    """
+
+    def __init__(self, model_dir, device=None, max_length=128):
+        model_dir = Path(model_dir)
+        with open(model_dir / "config.json", "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.categories = self.config["categories"]
+        self.keywords = [tuple(k) for k in self.config["keywords"]]
+        self.max_length = self.config.get("max_length", max_length)
+        self.topk_mean = self.config.get("topk_mean")
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        # students saved before the encoder config was stored need the pretrained encoder
+        encoder_dir = model_dir / ENCODER_SUBDIR
+        encoder_config = AutoConfig.from_pretrained(encoder_dir) if encoder_dir.exists() else None
+        self.model = CityPulseStudent(self.config["encoder"], self.categories, len(self.keywords), encoder_config=encoder_config)
+        state = torch.load(model_dir / "student.pt", map_location="cpu")
+        self.model.load_state_dict(state)
+        self.model.to(self.device).eval()
+
+        # keyword columns belonging to each category
+        self._kw_cols = {cat: [i for i, (c, _) in enumerate(self.keywords) if c == cat] for cat in self.categories}
+
+    @torch.no_grad()
+    def predict_raw(self, texts, batch_size=64):
+        """Return (topic_scores [N,11], sentiment_probs [N,3], keyword_scores [N,K]) as CPU tensors."""
+        topics, sents, kws = [], [], []
+        for start in range(0, len(texts), batch_size):
+            enc = self.tokenizer(
+                list(texts[start:start + batch_size]), padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="pt",
+            ).to(self.device)
+            out = self.model(enc["input_ids"], enc["attention_mask"])
+            topics.append(torch.sigmoid(out["topic_logits"]).cpu())
+            sents.append(torch.softmax(out["sentiment_logits"], dim=-1).cpu())
+            kws.append(torch.sigmoid(out["keyword_logits"]).cpu())
+        if not topics:
+            return torch.zeros(0, len(self.categories)), torch.zeros(0, 3), torch.zeros(0, len(self.keywords))
+        return torch.cat(topics), torch.cat(sents), torch.cat(kws)
+
+    def classify_batch(self, texts, topk_mean=None, threshold=0.25, batch_size=64):
+        """
+        Same output per text as classify_with_sentiment.
+        The top-k aggregation is baked in from the teacher labels the student was
+        trained on, so `topk_mean` must match the trained one (None and 1 both
+        mean top-1, as in classify_citypulse_topic); anything else raises ValueError.
+        """
+        if self.topk_mean is not None and max(topk_mean or 1, 1) != max(self.topk_mean or 1, 1):
+            raise ValueError(f"student was trained with topk_mean={self.topk_mean}, got topk_mean={topk_mean}")
+        topic, sent, kw = self.predict_raw(texts, batch_size=batch_size)
+        outputs = []
+        for i in range(len(texts)):
+            per_cat = {cat: float(topic[i, j]) for j, cat in enumerate(self.categories)}
+            best_cat, best_score = max(per_cat.items(), key=lambda kv: kv[1])
+            cols = self._kw_cols[best_cat]
+            label_scores = sorted(((self.keywords[c][1], float(kw[i, c])) for c in cols), key=lambda x: x[1], reverse=True)
+            s_idx = int(sent[i].argmax())
+            outputs.append({
+                "predicted_category": best_cat if best_score >= threshold else "none",
+                "category_score": best_score,
+                "top_keyword": label_scores[0][0] if label_scores else None,
+                "all_category_scores": per_cat,
+                "explanation_top3_keywords": label_scores[:3],
+                "sentiment": {"label": SENTIMENT_LABELS[s_idx], "score": float(sent[i, s_idx])},
+            })
+        return outputs
+
+    def classify(self, text, **kwargs):
+        return self.classify_batch([text], **kwargs)[0]
+
+
+__all__ = [
+    "DEFAULT_ENCODER",
+    "ENCODER_SUBDIR",
+    "SENTIMENT_LABELS",
+    "keyword_index",
+    "CityPulseStudent",
+    "StudentClassifier",
+]
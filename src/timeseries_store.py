@@ -0,0 +1,281 @@
+"""
+Compact rolling per-city time series for history queries.
+
+Each city gets fixed-size, array-backed ring buffers at three resolutions
+(minute / hour / day). A bin holds:
+  count    posts in the bin
+  score    the live map score sampled at the bin end: sum of
+           exp(-DECAY_RATE * (bin_end - posted_at)) over posts in the preceding
+           WINDOW_SECONDS, so it means the same thing at every resolution
+  topics   per-topic sum and count of signed topic scores (allocated on first use)
+
+Adding a post touches at most WINDOW_SECONDS / width + 1 bins per resolution
+(61 minute bins, one hour or day bin) and memory per city is fixed: a slot is
+reused once its absolute bin number falls out of the ring. When downsampling,
+counts and topic sums are added up while the score takes the value at the end
+of each output bin.
+"""
+import json
+import math
+import threading
+
+import numpy as np
+
+from src.CHS_computation import CHS_WEIGHTS
+
+# same decay and window as app.calculate_city_scores
+DECAY_RATE = 0.001919
+WINDOW_SECONDS = 3600
+
+TOPICS = list(CHS_WEIGHTS.keys())
+_TOPIC_IDX = {t: i for i, t in enumerate(TOPICS)}
+
+# name -> (bin width in seconds, number of bins)
+RESOLUTIONS = {
+    "minute": (60, 24 * 60),      # 24 hours
+    "hour": (3600, 14 * 24),      # 14 days
+    "day": (86400, 366),          # 1 year
+}
+
+
+class _Ring:
+    __slots__ = ("width", "n", "bin_id", "count", "score", "topic_sum", "topic_count")
+
+    def __init__(self, width, n):
+        self.width = width
+        self.n = n
+        self.bin_id = np.full(n, -1, dtype=np.int64)
+        self.count = np.zeros(n, dtype=np.int32)
+        self.score = np.zeros(n, dtype=np.float64)
+        self.topic_sum = None
+        self.topic_count = None
+
+    def _slot(self, b):
+        s = b % self.n
+        if self.bin_id[s] != b:
+            if self.bin_id[s] > b:
+                # older than everything the ring still holds
+                return -1
+            self.bin_id[s] = b
+            self.count[s] = 0
+            self.score[s] = 0.0
+            if self.topic_sum is not None:
+                self.topic_sum[s] = 0.0
+                self.topic_count[s] = 0
+        return s
+
+    def add(self, ts, topic_idx=None, signed=0.0):
+        b = ts // self.width
+        s = self._slot(b)
+        if s < 0:
+            return
+        self.count[s] += 1
+        # the post counts towards the sampled score of every bin ending within the window after it
+        last = (ts + WINDOW_SECONDS - 1) // self.width - 1
+        if last == b:
+            self.score[s] += math.exp(-DECAY_RATE * ((b + 1) * self.width - ts))
+        elif last > b:
+            ids = np.arange(b, last + 1, dtype=np.int64)
+            slots = ids % self.n
+            current = self.bin_id[slots]
+            keep = current <= ids
+            stale = slots[keep & (current != ids)]
+            if len(stale):
+                self.bin_id[stale] = ids[keep & (current != ids)]
+                self.count[stale] = 0
+                self.score[stale] = 0.0
+                if self.topic_sum is not None:
+                    self.topic_sum[stale] = 0.0
+                    self.topic_count[stale] = 0
+            self.score[slots[keep]] += np.exp(-DECAY_RATE * ((ids[keep] + 1) * self.width - ts))
+        if topic_idx is not None:
+            if self.topic_sum is None:
+                self.topic_sum = np.zeros((self.n, len(TOPICS)), dtype=np.float32)
+                self.topic_count = np.zeros((self.n, len(TOPICS)), dtype=np.int32)
+            self.topic_sum[s, topic_idx] += signed
+            self.topic_count[s, topic_idx] += 1
+
+    def read(self, first_bin, last_bin):
+        """Dense arrays for absolute bins [first_bin, last_bin]; missing/expired bins are zero."""
+        bins = np.arange(first_bin, last_bin + 1, dtype=np.int64)
+        slots = bins % self.n
+        valid = self.bin_id[slots] == bins
+        count = np.where(valid, self.count[slots], 0)
+        score = np.where(valid, self.score[slots], 0.0)
+        if self.topic_sum is None:
+            tsum = np.zeros((len(bins), len(TOPICS)), dtype=np.float32)
+            tcnt = np.zeros((len(bins), len(TOPICS)), dtype=np.int32)
+        else:
+            tsum = np.where(valid[:, None], self.topic_sum[slots], 0.0)
+            tcnt = np.where(valid[:, None], self.topic_count[slots], 0)
+        return bins, count, score, tsum, tcnt
+
+
+class TimeSeriesStore:
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = dict(resolutions)
+        self._cities = {}
+        self._dirty = set()  # cities changed since the last dirty_cities() call
+        self._lock = threading.Lock()
+
+    def cities(self):
+        with self._lock:
+            return list(self._cities)
+
+    def add(self, city, posted_at_timestamp, topic=None, signed_score=0.0):
+        """
+        Record one post. `topic` (an OECD topic name) and `signed_score` in [-1, 1]
+        are optional, for posts that have been classified.
+        """
+        ts = int(posted_at_timestamp)
+        topic_idx = _TOPIC_IDX.get(topic) if topic is not None else None
+        with self._lock:
+            rings = self._cities.get(city)
+            if rings is None:
+                rings = self._cities[city] = {name: _Ring(w, n) for name, (w, n) in self.resolutions.items()}
+            for ring in rings.values():
+                ring.add(ts, topic_idx, signed_score)
+            self._dirty.add(city)
+
+    def series(self, city, start, end, step=None):
+        """
+        Downsampled series for `city` over [start, end] (unix seconds).
+
+        step: output bin width in seconds. The finest stored resolution that
+        covers the range is used (not coarser than `step` where possible) and
+        `step` is rounded to a multiple of it; a step finer than that resolution
+        is served at the resolution itself. Returns a dict with one row per
+        output bin.
+        """
+        start, end = int(start), int(end)
+        if end < start:
+            raise ValueError("end must be >= start")
+        with self._lock:
+            rings = self._cities.get(city)
+            if rings is None:
+                return None
+            # finest resolution whose ring still reaches back to `start`; the coarsest if none does
+            candidates = sorted(rings.items(), key=lambda kv: kv[1].width)
+            covering = [(n, r) for n, r in candidates if end // r.width - start // r.width < r.n]
+            name, ring = covering[0] if covering else candidates[-1]
+            first, last = start // ring.width, end // ring.width
+            first = max(first, last - ring.n + 1)
+            bins, count, score, tsum, tcnt = ring.read(first, last)
+
+        factor = max(1, int(step // ring.width)) if step else 1
+        # pad to a whole number of output bins, aligned to the output step
+        pad_front = (bins[0] % factor) if factor > 1 else 0
+        total = pad_front + len(bins)
+        pad_back = (-total) % factor
+        def _pad(a):
+            widths = [(pad_front, pad_back)] + [(0, 0)] * (a.ndim - 1)
+            return np.pad(a, widths)
+        count, tsum, tcnt = (_pad(a).reshape(-1, factor, *a.shape[1:]).sum(axis=1) for a in (count, tsum, tcnt))
+        # score is a sample at the bin end: take the last stored bin of each output bin
+        last_idx = np.minimum(np.arange(1, len(count) + 1) * factor - 1 - pad_front, len(bins) - 1)
+        score = score[last_idx]
+        first_out = bins[0] - pad_front
+
+        width = ring.width * factor
+        rows = []
+        for i in range(len(count)):
+            topics = {
+                t: {"sum": float(tsum[i, j]), "count": int(tcnt[i, j]), "mean": float(tsum[i, j] / tcnt[i, j])}
+                for j, t in enumerate(TOPICS) if tcnt[i, j] > 0
+            }
+            rows.append({
+                "start": int((first_out + i * factor) * ring.width),
+                "count": int(count[i]),
+                "score": float(score[i]),
+                "topics": topics,
+            })
+        return {"city": city, "resolution": name, "step_seconds": width, "bins": rows}
+
+    def dirty_cities(self):
+        """Cities added to since they were last passed to `mark_clean`."""
+        with self._lock:
+            return set(self._dirty)
+
+    def mark_clean(self, cities):
+        """Call once the given cities' history has been persisted."""
+        with self._lock:
+            self._dirty.difference_update(cities)
+
+    def export_city(self, city):
+        """
+        A city's ring buffers as bytes (for checkpoints): a JSON header line
+        describing each ring, then the raw arrays in header order.
+        """
+        header, chunks = [], []
+        with self._lock:
+            for name, r in self._cities[city].items():
+                has_topics = r.topic_sum is not None
+                header.append([name, r.width, r.n, len(TOPICS) if has_topics else 0])
+                chunks += [r.bin_id.tobytes(), r.count.tobytes(), r.score.tobytes()]
+                if has_topics:
+                    chunks += [r.topic_sum.tobytes(), r.topic_count.tobytes()]
+        return json.dumps(header).encode("utf-8") + b"\n" + b"".join(chunks)
+
+    def import_city(self, city, data):
+        """Restore a city exported by `export_city`; returns False if the layout no longer matches."""
+        head, _, body = bytes(data).partition(b"\n")
+        header = json.loads(head)
+        if sorted((name, w, n) for name, w, n, _ in header) != sorted((name, w, n) for name, (w, n) in self.resolutions.items()):
+            return False
+        rings, pos = {}, 0
+
+        def take(dtype, count):
+            nonlocal pos
+            a = np.frombuffer(body, dtype=dtype, count=count, offset=pos).copy()
+            pos += a.nbytes
+            return a
+
+        for name, w, n, n_topics in header:
+            if n_topics not in (0, len(TOPICS)):
+                return False
+            r = _Ring(w, n)
+            r.bin_id, r.count, r.score = take(np.int64, n), take(np.int32, n), take(np.float64, n)
+            if n_topics:
+                r.topic_sum = take(np.float32, n * n_topics).reshape(n, n_topics)
+                r.topic_count = take(np.int32, n * n_topics).reshape(n, n_topics)
+            rings[name] = r
+        with self._lock:
+            self._cities[city] = rings
+        return True
+
+    def memory_bytes(self):
+        with self._lock:
+            total = 0
+            for rings in self._cities.values():
+                for r in rings.values():
+                    total += r.bin_id.nbytes + r.count.nbytes + r.score.nbytes
+                    if r.topic_sum is not None:
+                        total += r.topic_sum.nbytes + r.topic_count.nbytes
+            return total
+
+
+def add_batch_results(store, results):
+    """
+    Seed a store from run_batch_analysis output (list of city dicts with
+    `timeseries` rows), recovering each post's signed topic score from its
+    0-10 topic scores (5.0 = neutral / not this topic).
+    """
+    for city in results:
+        for row in city.get("timeseries", []):
+            ts = row.get("posted_at_timestamp")
+            if ts is None:
+                continue
+            topic, signed = None, 0.0
+            for t, v in (row.get("topic_scores_0_10") or {}).items():
+                s = v / 10.0 * 2.0 - 1.0
+                if abs(s) > abs(signed):
+                    topic, signed = t, s
+            store.add(city["city"], ts, topic=topic, signed_score=signed)
+
+
+__all__ = [
+    "DECAY_RATE",
+    "RESOLUTIONS",
+    "TimeSeriesStore",
+    "add_batch_results",
+]